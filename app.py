@@ -2,6 +2,8 @@ from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
 import time
 import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from trading_engine import TradingEngine
@@ -25,6 +27,10 @@ market_fetcher = MarketDataFetcher()
 trading_engines = {}
 auto_trading = True
 
+# Worker pool the trading loop dispatches model cycles to
+MAX_CONCURRENT_CYCLES = 8
+cycle_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CYCLES, thread_name_prefix='trading-cycle')
+
 def validate_okx_config(data):
     """Validate OKX configuration"""
     try:
@@ -252,6 +258,7 @@ def update_model(model_id):
         
         # Restart trading engine if it was running
         if model_id in trading_engines:
+            trading_engines[model_id].close()
             del trading_engines[model_id]
             init_trading_engine_with_okx(model_id)
         
@@ -268,6 +275,7 @@ def delete_model(model_id):
         
         db.delete_model(model_id)
         if model_id in trading_engines:
+            trading_engines[model_id].close()
             del trading_engines[model_id]
         
         print(f"[INFO] Model {model_id} ({model_name}) deleted")
@@ -532,6 +540,10 @@ def calibrate_initial_capital(model_id):
     conn.commit()
     conn.close()
 
+    # 同步引擎缓存的初始资金
+    if model_id in trading_engines:
+        trading_engines[model_id].initial_capital = new_initial
+
     # 清除缓存
     if hasattr(db, '_okx_cache'):
         cache_key = f'okx_portfolio_{model_id}'
@@ -546,11 +558,34 @@ def calibrate_initial_capital(model_id):
         'adjustment': new_initial - old_initial
     })
 
+def run_model_cycle(model_id, engine):
+    """Run one trading cycle for a model and report the outcome"""
+    try:
+        result = engine.execute_trading_cycle()
+        
+        if result.get('success'):
+            print(f"[OK] Model {model_id} completed")
+            if result.get('executions'):
+                for exec_result in result['executions']:
+                    signal = exec_result.get('signal', 'unknown')
+                    coin = exec_result.get('coin', 'unknown')
+                    msg = exec_result.get('message', '')
+                    if signal != 'hold':
+                        print(f"  [TRADE] {coin}: {msg}")
+        else:
+            error = result.get('error', 'Unknown error')
+            print(f"[WARN] Model {model_id} failed: {error}")
+            
+    except Exception as e:
+        print(f"[ERROR] Model {model_id} exception: {e}")
+        print(traceback.format_exc())
+
 def trading_loop():
     print("[INFO] Trading loop started")
     
-    # Track last execution time for each model
+    # Track last execution time and in-flight cycle for each model
     last_execution = {}
+    running_cycles = {}
     
     while auto_trading:
         try:
@@ -558,11 +593,20 @@ def trading_loop():
                 time.sleep(30)
                 continue
             
+            # Forget cycles that have finished
+            for model_id, future in list(running_cycles.items()):
+                if future.done():
+                    del running_cycles[model_id]
+            
             current_time = time.time()
             executed_models = []
             
             for model_id, engine in list(trading_engines.items()):
                 try:
+                    # A model's previous cycle is still running
+                    if model_id in running_cycles:
+                        continue
+                    
                     # Get model configuration
                     model = db.get_model(model_id)
                     if not model:
@@ -578,35 +622,21 @@ def trading_loop():
                     
                     if current_time - last_exec_time >= trading_frequency:
                         print(f"\n[EXEC] Model {model_id} (frequency: {trading_frequency}s)")
-                        result = engine.execute_trading_cycle()
+                        running_cycles[model_id] = cycle_pool.submit(run_model_cycle, model_id, engine)
                         
                         # Update last execution time
                         last_execution[model_id] = current_time
                         executed_models.append(model_id)
                         
-                        if result.get('success'):
-                            print(f"[OK] Model {model_id} completed")
-                            if result.get('executions'):
-                                for exec_result in result['executions']:
-                                    signal = exec_result.get('signal', 'unknown')
-                                    coin = exec_result.get('coin', 'unknown')
-                                    msg = exec_result.get('message', '')
-                                    if signal != 'hold':
-                                        print(f"  [TRADE] {coin}: {msg}")
-                        else:
-                            error = result.get('error', 'Unknown error')
-                            print(f"[WARN] Model {model_id} failed: {error}")
-                        
                 except Exception as e:
                     print(f"[ERROR] Model {model_id} exception: {e}")
-                    import traceback
                     print(traceback.format_exc())
                     continue
             
             if executed_models:
                 print(f"\n{'='*60}")
                 print(f"[CYCLE] {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"[INFO] Executed models: {executed_models}")
+                print(f"[INFO] Dispatched models: {executed_models}")
                 print(f"{'='*60}")
             
             # Sleep for a short interval before checking again
@@ -614,7 +644,6 @@ def trading_loop():
             
         except Exception as e:
             print(f"\n[CRITICAL] Trading loop error: {e}")
-            import traceback
             print(traceback.format_exc())
             print("[RETRY] Retrying in 60 seconds\n")
             time.sleep(60)
@@ -3,7 +3,9 @@ Database management module
 """
 import sqlite3
 import json
+import threading
 import time
+from contextlib import contextmanager
 from datetime import datetime
 from typing import List, Dict, Optional
 
@@ -22,6 +24,21 @@ except ImportError:
     SECURE_STORAGE_AVAILABLE = False
     print("[WARNING] Secure storage not available, using plain text")
 
+class _TransactionConnection:
+    """Connection handed out inside Database.transaction(); commit/close are deferred"""
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+    
+    def commit(self):
+        pass
+    
+    def close(self):
+        pass
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
 class Database:
     def __init__(self, db_path: str = 'trading_bot.db'):
         self.db_path = db_path
@@ -29,17 +46,71 @@ class Database:
         self._okx_cache_time = {}
         self._okx_cache_duration = 5  # 5 seconds cache
         
+        # Connection of the transaction open on the current thread, if any
+        self._local = threading.local()
+        
     def get_connection(self):
         """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return _TransactionConnection(conn)
+        return self._connect()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
         conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
         return conn
     
+    @contextmanager
+    def transaction(self):
+        """Run every Database call on this thread in one transaction, committed once on exit
+        
+        A nested call runs as a savepoint of the outer transaction: if it fails,
+        its own writes are rolled back even when the caller swallows the error.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            depth = self._local.depth = self._local.depth + 1
+            savepoint = f'nested_{depth}'
+            if not conn.in_transaction:
+                # Nothing written yet; open the outer transaction so the savepoint nests in it
+                conn.execute('BEGIN')
+            conn.execute(f'SAVEPOINT {savepoint}')
+            try:
+                yield
+            except BaseException:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+                raise
+            else:
+                conn.execute(f'RELEASE {savepoint}')
+            finally:
+                self._local.depth = depth - 1
+            return
+        
+        conn = self._connect()
+        self._local.conn = conn
+        self._local.depth = 0
+        try:
+            yield
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            conn.close()
+    
     def init_db(self):
         """Initialize database tables"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL lets readers proceed while a cycle's transaction is writing
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Models table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS models (
@@ -739,6 +810,18 @@ class Database:
         conn.commit()
         conn.close()
     
+    def close_positions_for_coin(self, model_id: int, coin: str) -> bool:
+        """Close a coin's positions on every side; returns whether any existed"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM portfolios WHERE model_id = ? AND coin = ?
+        ''', (model_id, coin))
+        removed = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return removed
+    
     # ============ Trade Records ============
     
     def add_trade(self, model_id: int, coin: str, signal: str, quantity: float,
@@ -753,6 +836,42 @@ class Database:
         conn.commit()
         conn.close()
     
+    def close_and_record_trade(self, model_id: int, coin: str, side: str, quantity: float,
+                               price: float, leverage: int = 1, pnl: float = 0):
+        """Close position and record its closing trade in one transaction"""
+        with self.transaction():
+            self.close_position(model_id, coin, side)
+            self.add_trade(model_id, coin, 'close_position', quantity, price, leverage, side, pnl=pnl)
+    
+    def add_trades_batch(self, model_id: int, trades: List[tuple]):
+        """Add several trade records in one statement
+        
+        Each trade is (coin, signal, quantity, price, leverage, side, pnl).
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO trades (model_id, coin, signal, quantity, price, leverage, side, pnl)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(model_id,) + tuple(trade) for trade in trades])
+        conn.commit()
+        conn.close()
+    
+    def close_and_record_trades(self, model_id: int, closes: List[tuple]):
+        """Close several positions and record their closing trades in one transaction
+        
+        Each close is (coin, side, quantity, price, leverage, pnl).
+        """
+        with self.transaction():
+            conn = self.get_connection()
+            conn.executemany('''
+                DELETE FROM portfolios WHERE model_id = ? AND coin = ? AND side = ?
+            ''', [(model_id, coin, side) for coin, side, _, _, _, _ in closes])
+            self.add_trades_batch(model_id, [
+                (coin, 'close_position', quantity, price, leverage, side, pnl)
+                for coin, side, quantity, price, leverage, pnl in closes
+            ])
+    
     def get_trades(self, model_id: int, limit: int = 50) -> List[Dict]:
         """Get trade history"""
         conn = self.get_connection()
@@ -2,88 +2,12 @@
 Enhanced AI Trading Prompts
 """
 
-def get_enhanced_trading_prompt(market_state, portfolio, account_info, system_prompt=""):
-    """Generate enhanced trading prompt with comprehensive market analysis"""
-    
-    # Use custom system prompt if provided
-    if system_prompt.strip():
-        system_role = system_prompt.strip()
-    else:
-        system_role = """You are an expert cryptocurrency trader with 10+ years of experience in digital asset markets. 
+# Static prompt sections, built once at import
+DEFAULT_SYSTEM_ROLE = """You are an expert cryptocurrency trader with 10+ years of experience in digital asset markets. 
 You have deep knowledge of technical analysis, risk management, and market psychology. 
 Your trading decisions are based on comprehensive analysis of multiple factors."""
-    
-    prompt = f"""{system_role}
-
-🔍 MARKET ANALYSIS FRAMEWORK:
-
-📊 CURRENT MARKET DATA:
-"""
-    
-    # Enhanced market data presentation
-    for coin, data in market_state.items():
-        price = data['price']
-        change_24h = data['change_24h']
-        
-        # Market sentiment based on price change
-        if change_24h > 5:
-            sentiment = "🟢 BULLISH"
-        elif change_24h > 2:
-            sentiment = "🟡 POSITIVE"
-        elif change_24h > -2:
-            sentiment = "⚪ NEUTRAL"
-        elif change_24h > -5:
-            sentiment = "🟠 NEGATIVE"
-        else:
-            sentiment = "🔴 BEARISH"
-        
-        prompt += f"""
-{coin}: ${price:.2f} ({change_24h:+.2f}%) {sentiment}"""
-        
-        if 'indicators' in data and data['indicators']:
-            indicators = data['indicators']
-            sma7 = indicators.get('sma_7', 0)
-            sma14 = indicators.get('sma_14', 0)
-            rsi = indicators.get('rsi_14', 50)
-            
-            # Technical analysis
-            trend = "↗️ UPTREND" if sma7 > sma14 else "↘️ DOWNTREND"
-            rsi_signal = "🔥 OVERBOUGHT" if rsi > 70 else "❄️ OVERSOLD" if rsi < 30 else "⚖️ NEUTRAL"
-            
-            prompt += f"""
-  📈 Technical: SMA7: ${sma7:.2f}, SMA14: ${sma14:.2f} {trend}
-  📊 RSI: {rsi:.1f} {rsi_signal}
-  💹 7D Change: {indicators.get('price_change_7d', 0):+.1f}%"""
-    
-    # Account analysis
-    total_return = account_info['total_return']
-    performance_emoji = "🚀" if total_return > 10 else "📈" if total_return > 0 else "📉" if total_return > -10 else "💥"
-    
-    prompt += f"""
-
-💼 ACCOUNT STATUS:
-- Initial Capital: ${account_info['initial_capital']:,.2f}
-- Current Value: ${portfolio['total_value']:,.2f}
-- Available Cash: ${portfolio['cash']:,.2f}
-- Total Return: {total_return:+.2f}% {performance_emoji}
-- Positions Value: ${portfolio.get('positions_value', 0):,.2f}
 
-📋 CURRENT POSITIONS ({len(portfolio.get('positions', []))}/3):"""
-    
-    if portfolio['positions']:
-        for pos in portfolio['positions']:
-            side_emoji = "🟢" if pos['side'] == 'long' else "🔴"
-            current_price = market_state.get(pos['coin'], {}).get('price', pos['avg_price'])
-            pnl_pct = ((current_price - pos['avg_price']) / pos['avg_price'] * 100) if pos['side'] == 'long' else ((pos['avg_price'] - current_price) / pos['avg_price'] * 100)
-            pnl_emoji = "💰" if pnl_pct > 0 else "💸"
-            
-            prompt += f"""
-- {side_emoji} {pos['coin']} {pos['side'].upper()}: {pos['quantity']:.4f} @ ${pos['avg_price']:.2f}
-  Current: ${current_price:.2f} | P&L: {pnl_pct:+.1f}% {pnl_emoji} | Leverage: {pos['leverage']}x"""
-    else:
-        prompt += "\n- No open positions"
-    
-    prompt += """
+STRATEGY_FRAMEWORK = """
 
 🎯 TRADING STRATEGY FRAMEWORK:
 
@@ -156,5 +80,87 @@ HOLD SIGNALS:
 - Quality over quantity - wait for high-probability setups
 
 Analyze the current market conditions and provide your trading decisions in JSON format only."""
+
+def get_enhanced_trading_prompt(market_state, portfolio, account_info, system_prompt=""):
+    """Generate enhanced trading prompt with comprehensive market analysis"""
+    
+    # Use custom system prompt if provided
+    if system_prompt.strip():
+        system_role = system_prompt.strip()
+    else:
+        system_role = DEFAULT_SYSTEM_ROLE
+    
+    # Sections are collected in a list and joined once at the end
+    parts = [f"""{system_role}
+
+🔍 MARKET ANALYSIS FRAMEWORK:
+
+📊 CURRENT MARKET DATA:
+"""]
+    
+    # Enhanced market data presentation
+    for coin, data in market_state.items():
+        price = data['price']
+        change_24h = data['change_24h']
+        
+        # Market sentiment based on price change
+        if change_24h > 5:
+            sentiment = "🟢 BULLISH"
+        elif change_24h > 2:
+            sentiment = "🟡 POSITIVE"
+        elif change_24h > -2:
+            sentiment = "⚪ NEUTRAL"
+        elif change_24h > -5:
+            sentiment = "🟠 NEGATIVE"
+        else:
+            sentiment = "🔴 BEARISH"
+        
+        parts.append(f"""
+{coin}: ${price:.2f} ({change_24h:+.2f}%) {sentiment}""")
+        
+        if 'indicators' in data and data['indicators']:
+            indicators = data['indicators']
+            sma7 = indicators.get('sma_7', 0)
+            sma14 = indicators.get('sma_14', 0)
+            rsi = indicators.get('rsi_14', 50)
+            
+            # Technical analysis
+            trend = "↗️ UPTREND" if sma7 > sma14 else "↘️ DOWNTREND"
+            rsi_signal = "🔥 OVERBOUGHT" if rsi > 70 else "❄️ OVERSOLD" if rsi < 30 else "⚖️ NEUTRAL"
+            
+            parts.append(f"""
+  📈 Technical: SMA7: ${sma7:.2f}, SMA14: ${sma14:.2f} {trend}
+  📊 RSI: {rsi:.1f} {rsi_signal}
+  💹 7D Change: {indicators.get('price_change_7d', 0):+.1f}%""")
+    
+    # Account analysis
+    total_return = account_info['total_return']
+    performance_emoji = "🚀" if total_return > 10 else "📈" if total_return > 0 else "📉" if total_return > -10 else "💥"
+    
+    parts.append(f"""
+
+💼 ACCOUNT STATUS:
+- Initial Capital: ${account_info['initial_capital']:,.2f}
+- Current Value: ${portfolio['total_value']:,.2f}
+- Available Cash: ${portfolio['cash']:,.2f}
+- Total Return: {total_return:+.2f}% {performance_emoji}
+- Positions Value: ${portfolio.get('positions_value', 0):,.2f}
+
+📋 CURRENT POSITIONS ({len(portfolio.get('positions', []))}/3):""")
+    
+    if portfolio['positions']:
+        for pos in portfolio['positions']:
+            side_emoji = "🟢" if pos['side'] == 'long' else "🔴"
+            current_price = market_state.get(pos['coin'], {}).get('price', pos['avg_price'])
+            pnl_pct = ((current_price - pos['avg_price']) / pos['avg_price'] * 100) if pos['side'] == 'long' else ((pos['avg_price'] - current_price) / pos['avg_price'] * 100)
+            pnl_emoji = "💰" if pnl_pct > 0 else "💸"
+            
+            parts.append(f"""
+- {side_emoji} {pos['coin']} {pos['side'].upper()}: {pos['quantity']:.4f} @ ${pos['avg_price']:.2f}
+  Current: ${current_price:.2f} | P&L: {pnl_pct:+.1f}% {pnl_emoji} | Leverage: {pos['leverage']}x""")
+    else:
+        parts.append("\n- No open positions")
+    
+    parts.append(STRATEGY_FRAMEWORK)
     
-    return prompt
\ No newline at end of file
+    return ''.join(parts)
@@ -2,10 +2,20 @@
 Market data module - Multi-source API integration (Binance, CoinGecko, OKX)
 """
 import requests
+import threading
 import time
 from typing import Dict, List
 from api_config import MARKET_DATA_CONFIG, ERROR_CONFIG
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# The indicators read only the latest closes: 14 for SMA-14 and 14 changes for RSI-14
+TA_WINDOW = 15
+
 class MarketDataFetcher:
     """Fetch real-time market data from multiple sources with fallback support"""
     
@@ -54,36 +64,45 @@ class MarketDataFetcher:
         self._request_counts = {}
         self._rate_limit_window = MARKET_DATA_CONFIG['rate_limit_window']
         self._max_requests_per_minute = MARKET_DATA_CONFIG['max_requests_per_minute']
+        self._rate_limit_lock = threading.Lock()
     
     def _rate_limit_check(self, source: str) -> bool:
         """Check if we can make a request to the given source"""
-        current_time = time.time()
-        
-        # Check minimum interval
-        if source in self._last_request_time:
-            time_diff = current_time - self._last_request_time[source]
-            if time_diff < self._min_request_interval:
-                print(f"[INFO] Rate limiting {source}: waiting {self._min_request_interval - time_diff:.1f}s")
-                time.sleep(self._min_request_interval - time_diff)
-        
-        # Check requests per minute
-        if source not in self._request_counts:
-            self._request_counts[source] = []
-        
-        # Clean old requests
-        self._request_counts[source] = [
-            req_time for req_time in self._request_counts[source]
-            if current_time - req_time < self._rate_limit_window
-        ]
-        
-        # Check if we're over the limit
-        if len(self._request_counts[source]) >= self._max_requests_per_minute:
-            print(f"[WARNING] Rate limit exceeded for {source}, skipping request")
-            return False
+        # Reserve a send slot under the lock, then wait for it outside so
+        # concurrent callers stay spaced without blocking each other's I/O
+        with self._rate_limit_lock:
+            current_time = time.time()
+            send_time = current_time
+            
+            # Check minimum interval
+            if source in self._last_request_time:
+                time_diff = current_time - self._last_request_time[source]
+                if time_diff < self._min_request_interval:
+                    send_time = self._last_request_time[source] + self._min_request_interval
+                    print(f"[INFO] Rate limiting {source}: waiting {send_time - current_time:.1f}s")
+            
+            # Check requests per minute
+            if source not in self._request_counts:
+                self._request_counts[source] = []
+            
+            # Clean old requests
+            self._request_counts[source] = [
+                req_time for req_time in self._request_counts[source]
+                if current_time - req_time < self._rate_limit_window
+            ]
+            
+            # Check if we're over the limit
+            if len(self._request_counts[source]) >= self._max_requests_per_minute:
+                print(f"[WARNING] Rate limit exceeded for {source}, skipping request")
+                return False
+            
+            # Record this request
+            self._request_counts[source].append(send_time)
+            self._last_request_time[source] = send_time
         
-        # Record this request
-        self._request_counts[source].append(current_time)
-        self._last_request_time[source] = current_time
+        wait = send_time - time.time()
+        if wait > 0:
+            time.sleep(wait)
         return True
 
     def get_current_prices(self, coins: List[str]) -> Dict[str, float]:
@@ -385,8 +404,62 @@ class MarketDataFetcher:
         if not historical or len(historical) < 14:
             return {}
         
-        prices = [p['price'] for p in historical]
+        # Only the latest closes feed the indicators below
+        prices = [bar['price'] for bar in historical[-TA_WINDOW:]]
+        return self._indicators_from_closes(prices, historical[0]['price'])
+    
+    def calculate_technical_indicators_batch(self, coins: List[str], executor=None) -> Dict[str, Dict]:
+        """Calculate technical indicators for several coins at once
+        
+        Histories are fetched through `executor` when given (they are
+        network-bound), then the indicators of all coins with a full window
+        are computed together as one matrix when NumPy is installed.
+        """
+        fetch = lambda coin: self.get_historical_prices(coin, days=14)
+        histories = list(executor.map(fetch, coins)) if executor else [fetch(coin) for coin in coins]
+        
+        windows = {}
+        for coin, historical in zip(coins, histories):
+            if historical and len(historical) >= 14:
+                windows[coin] = ([bar['price'] for bar in historical[-TA_WINDOW:]], historical[0]['price'])
+        
+        results = {coin: {} for coin in coins}
+        if NUMPY_AVAILABLE:
+            full = [coin for coin, (prices, _) in windows.items() if len(prices) == TA_WINDOW]
+            if full:
+                results.update(self._indicators_matrix(full, windows))
+        for coin, (prices, first_price) in windows.items():
+            if not results[coin]:
+                results[coin] = self._indicators_from_closes(prices, first_price)
+        return results
+    
+    @staticmethod
+    def _indicators_matrix(coins: List[str], windows: Dict) -> Dict[str, Dict]:
+        """Indicators for coins whose windows are all full, one row per coin"""
+        closes = np.array([windows[coin][0] for coin in coins])
+        changes = np.diff(closes, axis=1)
+        
+        sma_7 = (closes[:, -7:].sum(axis=1) / 7).tolist()
+        sma_14 = (closes[:, -14:].sum(axis=1) / 14).tolist()
+        avg_gain = (np.where(changes > 0, changes, 0.0).sum(axis=1) / 14).tolist()
+        avg_loss = (np.where(changes < 0, -changes, 0.0).sum(axis=1) / 14).tolist()
+        last = closes[:, -1].tolist()
         
+        results = {}
+        for i, coin in enumerate(coins):
+            first_price = windows[coin][1]
+            results[coin] = {
+                'sma_7': sma_7[i],
+                'sma_14': sma_14[i],
+                'rsi_14': 100 if avg_loss[i] == 0 else 100 - (100 / (1 + avg_gain[i] / avg_loss[i])),
+                'current_price': last[i],
+                'price_change_7d': ((last[i] - first_price) / first_price) * 100 if first_price > 0 else 0
+            }
+        return results
+    
+    @staticmethod
+    def _indicators_from_closes(prices: List[float], first_price: float) -> Dict:
+        """Indicators from a coin's latest closes and the first price of its history"""
         # Simple Moving Average
         sma_7 = sum(prices[-7:]) / 7 if len(prices) >= 7 else prices[-1]
         sma_14 = sum(prices[-14:]) / 14 if len(prices) >= 14 else prices[-1]
@@ -410,7 +483,7 @@ class MarketDataFetcher:
             'sma_14': sma_14,
             'rsi_14': rsi,
             'current_price': prices[-1],
-            'price_change_7d': ((prices[-1] - prices[0]) / prices[0]) * 100 if prices[0] > 0 else 0
+            'price_change_7d': ((prices[-1] - first_price) / first_price) * 100 if first_price > 0 else 0
         }
     
     def get_data_source_status(self) -> Dict[str, str]:
@@ -3,12 +3,22 @@ OKX API Client Module
 """
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     REQUESTS_AVAILABLE = True
 except ImportError:
     REQUESTS_AVAILABLE = False
     print("[WARNING] requests module not available, OKX client will work in test mode only")
 
+try:
+    import websockets
+    WEBSOCKETS_AVAILABLE = True
+except ImportError:
+    WEBSOCKETS_AVAILABLE = False
+
+import asyncio
 import json
+import threading
 import time
 import hmac
 import hashlib
@@ -21,11 +31,35 @@ from typing import Dict, List, Optional
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# One keep-alive HTTP session shared by every OKXClient in the process
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def get_shared_session():
+    """Return the process-wide requests.Session used for OKX REST calls"""
+    global _shared_session
+    if _shared_session is None and REQUESTS_AVAILABLE:
+        with _shared_session_lock:
+            if _shared_session is None:
+                session = requests.Session()
+                # Pool sized for several engines trading at once; retry only failed
+                # connects, since a request that reached OKX may have placed an order
+                adapter = HTTPAdapter(
+                    pool_connections=16,
+                    pool_maxsize=64,
+                    max_retries=Retry(total=3, connect=3, read=0, status=0, redirect=0, backoff_factor=0.2)
+                )
+                session.mount('https://', adapter)
+                _shared_session = session
+    return _shared_session
+
 
 class OKXClient:
     """OKX API Client for trading operations"""
     
-    def __init__(self, api_key: str, secret_key: str, passphrase: str, sandbox: bool = True):
+    def __init__(self, api_key: str, secret_key: str, passphrase: str, sandbox: bool = True,
+                 session=None):
         self.api_key = api_key
         self.secret_key = secret_key
         self.passphrase = passphrase
@@ -43,6 +77,7 @@ class OKXClient:
         self._min_request_interval = 0.1  # 100ms between requests
         self._max_requests_per_second = 10  # OKX limit
         self._max_requests_per_minute = 600  # OKX limit
+        self._rate_limit_lock = threading.Lock()
 
         # Cache
         self._cache = {}
@@ -53,6 +88,10 @@ class OKXClient:
         self._account_config = None
         self._account_config_time = 0
         self._account_config_duration = 300  # 5 minutes cache
+        self._config_loaded = False
+
+        # Keep-alive HTTP session (reuses TCP+TLS connections across requests and clients)
+        self._session = session if session is not None else get_shared_session()
     
     def _get_timestamp(self) -> str:
         """Get ISO timestamp for OKX API requests"""
@@ -91,6 +130,12 @@ class OKXClient:
     
     def _rate_limit(self, endpoint: str):
         """Enhanced rate limiting implementation"""
+        # Serialize callers so concurrent requests see each other's timestamps
+        with self._rate_limit_lock:
+            self._wait_for_slot(endpoint)
+    
+    def _wait_for_slot(self, endpoint: str):
+        """Sleep until `endpoint` may be called again, then record the request"""
         current_time = time.time()
         
         # Initialize tracking for this endpoint
@@ -157,9 +202,9 @@ class OKXClient:
         for attempt in range(retry_count):
             try:
                 if method.upper() == 'GET':
-                    response = requests.get(url, params=params, headers=headers, timeout=10)
+                    response = self._session.get(url, params=params, headers=headers, timeout=10)
                 elif method.upper() == 'POST':
-                    response = requests.post(url, data=body_str, headers=headers, timeout=10)
+                    response = self._session.post(url, data=body_str, headers=headers, timeout=10)
                 else:
                     raise ValueError(f"Unsupported HTTP method: {method}")
                 
@@ -305,6 +350,12 @@ class OKXClient:
                 return self._account_config
             return {'position_mode': 'long_short_mode'}  # Default to long_short_mode
     
+    def ensure_config_loaded(self):
+        """Fetch and log the account config once for this client"""
+        if not self._config_loaded:
+            self.get_account_config()
+            self._config_loaded = True
+    
     def get_account_balance(self) -> Dict:
         """Get account balance information"""
         cache_key = 'account_balance'
@@ -363,6 +414,36 @@ class OKXClient:
             print(f"[ERROR] Failed to get account balance: {e}")
             raise e
     
+    @staticmethod
+    def _parse_position(pos_data: Dict) -> Optional[Dict]:
+        """Convert a raw OKX position record to our format (None if the size is zero)"""
+        # Helper function to safely convert to float
+        def safe_float(value, default=0):
+            if value is None or value == '' or value == 'null':
+                return default
+            try:
+                return float(value)
+            except (ValueError, TypeError):
+                return default
+        
+        # Get position size safely
+        pos_size = safe_float(pos_data.get('pos', 0))
+        
+        # Only include positions with non-zero size
+        if pos_size == 0:
+            return None
+        
+        return {
+            'symbol': pos_data.get('instId', ''),
+            'side': 'long' if pos_size > 0 else 'short',
+            'size': abs(pos_size),
+            'avg_price': safe_float(pos_data.get('avgPx', 0)),
+            'mark_price': safe_float(pos_data.get('markPx', 0)),
+            'unrealized_pnl': safe_float(pos_data.get('upl', 0)),
+            'leverage': safe_float(pos_data.get('lever', 1), 1),
+            'margin': safe_float(pos_data.get('margin', 0))
+        }
+    
     def get_positions(self) -> List[Dict]:
         """Get current positions"""
         try:
@@ -373,30 +454,8 @@ class OKXClient:
             
             if 'data' in response:
                 for pos_data in response['data']:
-                    # Helper function to safely convert to float
-                    def safe_float(value, default=0):
-                        if value is None or value == '' or value == 'null':
-                            return default
-                        try:
-                            return float(value)
-                        except (ValueError, TypeError):
-                            return default
-                    
-                    # Get position size safely
-                    pos_size = safe_float(pos_data.get('pos', 0))
-                    
-                    # Only include positions with non-zero size
-                    if pos_size != 0:
-                        position = {
-                            'symbol': pos_data.get('instId', ''),
-                            'side': 'long' if pos_size > 0 else 'short',
-                            'size': abs(pos_size),
-                            'avg_price': safe_float(pos_data.get('avgPx', 0)),
-                            'mark_price': safe_float(pos_data.get('markPx', 0)),
-                            'unrealized_pnl': safe_float(pos_data.get('upl', 0)),
-                            'leverage': safe_float(pos_data.get('lever', 1), 1),
-                            'margin': safe_float(pos_data.get('margin', 0))
-                        }
+                    position = self._parse_position(pos_data)
+                    if position:
                         positions.append(position)
             
             return positions
@@ -735,8 +794,7 @@ class OKXClient:
         try:
             # Clear position cache to get fresh data
             cache_key = 'positions'
-            if cache_key in self._cache:
-                del self._cache[cache_key]
+            if self._cache.pop(cache_key, None) is not None:
                 print(f"[INFO] Cleared positions cache for fresh data")
 
             # Get current position with fresh data
@@ -797,4 +855,119 @@ class OKXClient:
             return {
                 'success': False,
                 'message': f'Close position failed: {error_msg}'
-            }
\ No newline at end of file
+            }
+
+
+class OKXPositionStream:
+    """Background subscription to the OKX private `positions` WebSocket channel
+
+    Runs its own asyncio event loop in a daemon thread and calls
+    ``on_update(positions, snapshot)`` with parsed positions (same format as
+    ``OKXClient.get_positions``) whenever OKX pushes a change. ``snapshot`` is
+    True when the message replaces the full position set.
+    """
+    
+    PRIVATE_WS_URL = "wss://ws.okx.com:8443/ws/v5/private"
+    SANDBOX_PRIVATE_WS_URL = "wss://wspap.okx.com:8443/ws/v5/private?brokerId=9999"
+    
+    def __init__(self, client: OKXClient, on_update):
+        self._client = client
+        self._on_update = on_update
+        self._url = self.SANDBOX_PRIVATE_WS_URL if client.sandbox else self.PRIVATE_WS_URL
+        self._thread = None
+        self._stopped = False
+        self._ready = threading.Event()  # Set once the first snapshot arrived
+        self._reconnect_delay = 5  # seconds
+        self._idle_timeout = 25  # OKX drops connections idle for 30s
+    
+    @property
+    def ready(self) -> bool:
+        """Whether the stream is connected and has delivered a positions snapshot"""
+        return self._ready.is_set()
+    
+    def start(self):
+        """Start the background subscription (no-op if already running)"""
+        if not WEBSOCKETS_AVAILABLE:
+            raise RuntimeError("websockets module not available")
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='okx-positions-stream')
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the subscription; the thread exits on its next wake-up"""
+        self._stopped = True
+        self._ready.clear()
+    
+    def _run(self):
+        asyncio.run(self._stream_forever())
+    
+    async def _stream_forever(self):
+        while not self._stopped:
+            try:
+                await self._stream()
+            except Exception as e:
+                logger.warning("OKX positions stream error: %s", e)
+            self._ready.clear()
+            if not self._stopped:
+                await asyncio.sleep(self._reconnect_delay)
+    
+    def _login_args(self) -> Dict:
+        timestamp = str(int(time.time()))
+        message = timestamp + 'GET' + '/users/self/verify'
+        sign = base64.b64encode(
+            hmac.new(
+                self._client.secret_key.encode('utf-8'),
+                message.encode('utf-8'),
+                hashlib.sha256
+            ).digest()
+        ).decode('utf-8')
+        return {
+            'apiKey': self._client.api_key,
+            'passphrase': self._client.passphrase,
+            'timestamp': timestamp,
+            'sign': sign
+        }
+    
+    async def _stream(self):
+        async with websockets.connect(self._url) as ws:
+            await ws.send(json.dumps({'op': 'login', 'args': [self._login_args()]}))
+            login = json.loads(await asyncio.wait_for(ws.recv(), timeout=10))
+            if login.get('event') != 'login' or login.get('code') != '0':
+                raise Exception(f"OKX WebSocket login failed: {login.get('msg', login)}")
+            
+            await ws.send(json.dumps({
+                'op': 'subscribe',
+                'args': [{'channel': 'positions', 'instType': 'SWAP'}]
+            }))
+            
+            while not self._stopped:
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=self._idle_timeout)
+                except asyncio.TimeoutError:
+                    await ws.send('ping')
+                    continue
+                
+                if raw == 'pong':
+                    continue
+                
+                message = json.loads(raw)
+                if message.get('event') == 'error':
+                    raise Exception(f"OKX WebSocket error {message.get('code')}: {message.get('msg')}")
+                if message.get('arg', {}).get('channel') != 'positions' or 'data' not in message:
+                    continue
+                
+                # The first push after subscribing is always a full snapshot
+                snapshot = message.get('eventType') == 'snapshot' or not self._ready.is_set()
+                positions = []
+                for pos_data in message['data']:
+                    position = OKXClient._parse_position(pos_data)
+                    if position:
+                        positions.append(position)
+                    elif not snapshot:
+                        # Zero-size update means the position was closed
+                        positions.append({'symbol': pos_data.get('instId', ''), 'size': 0})
+                
+                self._on_update(positions, snapshot)
+                self._ready.set()
@@ -0,0 +1,64 @@
+"""
+Numeric kernels for risk calculations
+
+Compiled with Numba when it is installed; otherwise the same loops run as
+plain Python, so callers never need to care which one they got.
+"""
+try:
+    import numpy as np
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+def as_array(values):
+    """Pack a sequence of numbers for the kernels (float64 ndarray under Numba)"""
+    if NUMBA_AVAILABLE:
+        return np.asarray(values, dtype=np.float64)
+    return [float(v) for v in values]
+
+
+@njit(cache=True, fastmath=True)
+def total_margin(quantities, prices, leverages):
+    """Sum of margin (notional / leverage) over all positions"""
+    total = 0.0
+    for i in range(len(quantities)):
+        total += quantities[i] * prices[i] / leverages[i]
+    return total
+
+
+@njit(cache=True, fastmath=True)
+def drawdown(history, initial, current):
+    """Drawdown of `current` from the peak of `history` and `initial` (never negative)"""
+    peak = initial
+    for i in range(len(history)):
+        if history[i] > peak:
+            peak = history[i]
+    dd = (peak - current) / peak
+    return dd if dd > 0 else 0.0
+
+
+# No fastmath here: disabled thresholds are passed in as infinity
+@njit(cache=True)
+def sl_tp_mask(entry, cur, sign, sl, tp):
+    """Per-position trigger codes: -1 stop loss, 1 take profit, 0 nothing
+
+    `sign` is 1.0 for longs and -1.0 for shorts; `sl`/`tp` are fractions
+    (0.05 = 5%). Stop loss wins when both would trigger.
+    """
+    n = len(entry)
+    mask = [0] * n
+    for i in range(n):
+        pnl_pct = sign[i] * (cur[i] - entry[i]) / entry[i]
+        if pnl_pct <= -sl:
+            mask[i] = -1
+        elif pnl_pct >= tp:
+            mask[i] = 1
+    return mask
@@ -2,14 +2,114 @@
 Risk Management Module for AI Trading System
 """
 from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+from datetime import date, timedelta
+import hashlib
 import logging
+import math
+import sys
+import threading
+import time
+
+from risk_kernels import as_array, drawdown, sl_tp_mask, total_margin
+
+__all__ = ['RiskManager', 'ValidationResult']
 
 logger = logging.getLogger(__name__)
 
+# Source for RiskManager's specialized order validator. Risk limits are
+# substituted as literals (and their messages preformatted) per instance.
+_VALIDATOR_TEMPLATE = '''
+def _validate(quantity, leverage, current_price, portfolio):
+    validation_result = ValidationResult(quantity, leverage)
+
+    # 1. Check position limits
+    if len(portfolio.get('positions', [])) >= {max_positions}:
+        validation_result.add_error({positions_error})
+
+    # 2. Check leverage limits
+    if leverage > {max_leverage}:
+        validation_result.adjusted_leverage = {max_leverage}
+        validation_result.add_warning(f"Leverage reduced from {{leverage}}x to " + {leverage_suffix})
+
+    # 3. Check order size
+    order_value = quantity * current_price
+    if order_value < {min_order_size}:
+        validation_result.add_error(f"Order size too small (${{order_value:.2f}} < " + {order_size_suffix})
+
+    # 4. Check risk per trade
+    account_value = portfolio.get('total_value', 0)
+    if account_value > 0:
+        risk_amount = order_value / leverage  # Margin required
+        risk_percentage = risk_amount / account_value
+
+        if risk_percentage > {max_risk_per_trade}:
+            # Adjust quantity to meet risk limit
+            max_risk_amount = account_value * {max_risk_per_trade}
+            max_order_value = max_risk_amount * leverage
+            adjusted_quantity = max_order_value / current_price
+
+            validation_result.adjusted_quantity = adjusted_quantity
+            validation_result.add_warning(
+                f"Quantity reduced from {{quantity:.4f}} to {{adjusted_quantity:.4f}} to meet risk limit"
+            )
+
+    # Checks 5-7 cost a risk calculation or DB queries; skip them once rejected
+    if not validation_result.valid:
+        return validation_result
+
+    # 5. Check total portfolio risk
+    total_risk = calculate_total_risk(portfolio)
+    if total_risk > {max_total_risk}:
+        validation_result.add_error(f"Total portfolio risk too high ({{total_risk:.1%}} > " + {total_risk_suffix})
+        return validation_result
+
+    # 6. Check daily trade limit
+    daily_trades = get_daily_trade_count()
+    if daily_trades >= {max_daily_trades}:
+        validation_result.add_error(f"Daily trade limit reached ({{daily_trades}}/" + {daily_trades_suffix})
+        return validation_result
+
+    # 7. Check drawdown
+    current_drawdown = calculate_drawdown(portfolio)
+    if current_drawdown > {max_drawdown}:
+        validation_result.add_error(f"Maximum drawdown exceeded ({{current_drawdown:.1%}} > " + {drawdown_suffix})
+
+    return validation_result
+'''
+
+class ValidationResult:
+    """Outcome of RiskManager.validate_order"""
+    
+    __slots__ = ('valid', 'errors', 'warnings', 'adjusted_quantity', 'adjusted_leverage')
+    
+    def __init__(self, quantity: float, leverage: int):
+        self.valid = True
+        self.errors = []
+        self.warnings = []
+        self.adjusted_quantity = quantity
+        self.adjusted_leverage = leverage
+    
+    def add_error(self, message: str):
+        """Record a blocking error and mark the order invalid"""
+        self.valid = False
+        self.errors.append(message)
+    
+    def add_warning(self, message: str):
+        """Record a non-blocking adjustment"""
+        self.warnings.append(message)
+
 class RiskManager:
     """Comprehensive risk management for trading operations"""
     
+    __slots__ = (
+        'model_id', 'db', 'risk_management_enabled',
+        'max_positions', 'max_risk_per_trade', 'max_total_risk', 'max_leverage',
+        'min_order_size', 'max_daily_trades', 'max_drawdown',
+        '_okx_client', '_okx_client_key', '_pos_cache', '_pos_cache_ttl',
+        '_positions_map', '_positions_lock', '_positions_stream', '_positions_stream_unavailable',
+        '_validate'
+    )
+    
     def __init__(self, model_id: int, db):
         self.model_id = model_id
         self.db = db
@@ -28,88 +128,74 @@ class RiskManager:
         self.min_order_size = model.get('min_order_size', 10) if model else 10  # Minimum $10 order
         self.max_daily_trades = model.get('max_daily_trades', 10) if model else 10
         self.max_drawdown = model.get('max_drawdown', 0.20) if model else 0.20  # 20% max drawdown
+
+        # Shared OKX client and short-lived exchange positions cache for SL/TP checks
+        self._okx_client = None
+        self._okx_client_key = None
+        self._pos_cache = (0.0, None)  # (timestamp, {coin: position})
+        self._pos_cache_ttl = 1.0  # seconds
+
+        # Positions pushed by the OKX WebSocket stream, keyed by coin
+        self._positions_map = {}
+        self._positions_lock = threading.Lock()
+        self._positions_stream = None
+        self._positions_stream_unavailable = False
+
+        # Order validator specialized for the limits above, built on first use
+        self._validate = None
         
     def validate_order(self, coin: str, side: str, quantity: float,
                       leverage: int, current_price: float,
-                      portfolio: Dict) -> Dict:
+                      portfolio: Dict) -> ValidationResult:
         """Comprehensive order validation"""
 
-        validation_result = {
-            'valid': True,
-            'errors': [],
-            'warnings': [],
-            'adjusted_quantity': quantity,
-            'adjusted_leverage': leverage
-        }
-
         # If risk management is disabled, skip all validations
         if not self.risk_management_enabled:
-            return validation_result
+            return ValidationResult(quantity, leverage)
 
         try:
-            # 1. Check position limits
-            current_positions = len(portfolio.get('positions', []))
-            if current_positions >= self.max_positions:
-                validation_result['valid'] = False
-                validation_result['errors'].append(f"Maximum positions limit reached ({self.max_positions})")
-            
-            # 2. Check leverage limits
-            if leverage > self.max_leverage:
-                validation_result['adjusted_leverage'] = self.max_leverage
-                validation_result['warnings'].append(f"Leverage reduced from {leverage}x to {self.max_leverage}x")
-            
-            # 3. Check order size
-            order_value = quantity * current_price
-            if order_value < self.min_order_size:
-                validation_result['valid'] = False
-                validation_result['errors'].append(f"Order size too small (${order_value:.2f} < ${self.min_order_size})")
-            
-            # 4. Check risk per trade
-            account_value = portfolio.get('total_value', 0)
-            if account_value > 0:
-                risk_amount = order_value / leverage  # Margin required
-                risk_percentage = risk_amount / account_value
-                
-                if risk_percentage > self.max_risk_per_trade:
-                    # Adjust quantity to meet risk limit
-                    max_risk_amount = account_value * self.max_risk_per_trade
-                    max_order_value = max_risk_amount * leverage
-                    adjusted_quantity = max_order_value / current_price
-                    
-                    validation_result['adjusted_quantity'] = adjusted_quantity
-                    validation_result['warnings'].append(
-                        f"Quantity reduced from {quantity:.4f} to {adjusted_quantity:.4f} to meet risk limit"
-                    )
-            
-            # 5. Check total portfolio risk
-            total_risk = self._calculate_total_risk(portfolio)
-            if total_risk > self.max_total_risk:
-                validation_result['valid'] = False
-                validation_result['errors'].append(f"Total portfolio risk too high ({total_risk:.1%} > {self.max_total_risk:.1%})")
-            
-            # 6. Check daily trade limit
-            daily_trades = self._get_daily_trade_count()
-            if daily_trades >= self.max_daily_trades:
-                validation_result['valid'] = False
-                validation_result['errors'].append(f"Daily trade limit reached ({daily_trades}/{self.max_daily_trades})")
-            
-            # 7. Check drawdown
-            drawdown = self._calculate_drawdown(portfolio)
-            if drawdown > self.max_drawdown:
-                validation_result['valid'] = False
-                validation_result['errors'].append(f"Maximum drawdown exceeded ({drawdown:.1%} > {self.max_drawdown:.1%})")
-            
-            return validation_result
+            if self._validate is None:
+                self._validate = self._build_validator()
+            return self._validate(quantity, leverage, current_price, portfolio)
             
         except Exception as e:
             logger.error(f"Risk validation error: {e}")
-            return {
-                'valid': False,
-                'errors': [f"Risk validation failed: {str(e)}"],
-                'warnings': [],
-                'adjusted_quantity': quantity,
-                'adjusted_leverage': leverage
-            }
+            failed_result = ValidationResult(quantity, leverage)
+            failed_result.add_error(f"Risk validation failed: {str(e)}")
+            return failed_result
+    
+    def _build_validator(self):
+        """Compile validate_order's checks with this model's risk limits inlined"""
+        limits = {
+            'max_positions': self.max_positions,
+            'max_risk_per_trade': self.max_risk_per_trade,
+            'max_total_risk': self.max_total_risk,
+            'max_leverage': self.max_leverage,
+            'min_order_size': self.min_order_size,
+            'max_daily_trades': self.max_daily_trades,
+            'max_drawdown': self.max_drawdown,
+        }
+        for name, value in limits.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError(f"Invalid risk parameter {name}={value!r}")
+
+        source = _VALIDATOR_TEMPLATE.format(
+            positions_error=repr(f"Maximum positions limit reached ({self.max_positions})"),
+            leverage_suffix=repr(f"{self.max_leverage}x"),
+            order_size_suffix=repr(f"${self.min_order_size})"),
+            total_risk_suffix=repr(f"{self.max_total_risk:.1%})"),
+            daily_trades_suffix=repr(f"{self.max_daily_trades})"),
+            drawdown_suffix=repr(f"{self.max_drawdown:.1%})"),
+            **{name: repr(value) for name, value in limits.items()}
+        )
+        namespace = {
+            'ValidationResult': ValidationResult,
+            'calculate_total_risk': self._calculate_total_risk,
+            'get_daily_trade_count': self._get_daily_trade_count,
+            'calculate_drawdown': self._calculate_drawdown,
+        }
+        exec(compile(source, f'<risk-validator-{self.model_id}>', 'exec'), namespace)
+        return namespace['_validate']
     
     def check_stop_loss_take_profit(self, portfolio: Dict, current_prices: Dict) -> List[Dict]:
         """Check if any positions need stop loss or take profit execution based on user configuration"""
@@ -133,20 +219,7 @@ class RiskManager:
         try:
             # Try to get OKX client from model
             if model.get('okx_api_key'):
-                from okx_client import OKXClient
-                okx_client = OKXClient(
-                    api_key=model['okx_api_key'],
-                    secret_key=model['okx_secret_key'],
-                    passphrase=model['okx_passphrase'],
-                    sandbox=model.get('okx_sandbox', True)
-                )
-                
-                okx_positions = okx_client.get_positions()
-                for pos in okx_positions:
-                    if abs(float(pos.get('size', 0))) > 0:  # Only active positions
-                        symbol = pos['symbol']
-                        coin = symbol.replace('-USDT-SWAP', '')
-                        exchange_positions[coin] = pos
+                exchange_positions = self._get_exchange_positions(model)
         except Exception as e:
             # If we can't get exchange positions, fall back to database positions
             pass
@@ -155,15 +228,36 @@ class RiskManager:
         stop_loss_pct = model.get('stop_loss_percentage', 5.0) / 100.0  # Convert to decimal
         take_profit_pct = model.get('take_profit_percentage', 15.0) / 100.0  # Convert to decimal
         
+        exchange_coins = exchange_positions.keys()
+        candidates = []
         for position in portfolio.get('positions', []):
             coin = position['coin']
             if coin not in current_prices:
                 continue
             
             # Skip if position doesn't exist on exchange (phantom position)
-            if exchange_positions and coin not in exchange_positions:
+            if exchange_coins and coin not in exchange_coins:
+                continue
+            
+            candidates.append(position)
+        
+        if not candidates:
+            return actions
+        
+        # Evaluate all positions in one kernel call
+        triggers = sl_tp_mask(
+            as_array([p['avg_price'] for p in candidates]),
+            as_array([current_prices[p['coin']] for p in candidates]),
+            as_array([1.0 if p['side'] == 'long' else -1.0 for p in candidates]),
+            stop_loss_pct if stop_loss_enabled else float('inf'),
+            take_profit_pct if take_profit_enabled else float('inf')
+        )
+        
+        for position, trigger in zip(candidates, triggers):
+            if not trigger:
                 continue
-                
+            
+            coin = position['coin']
             current_price = current_prices[coin]
             entry_price = position['avg_price']
             side = position['side']
@@ -176,7 +270,7 @@ class RiskManager:
                 pnl_pct = (entry_price - current_price) / entry_price
             
             # Check stop loss (user-configured percentage loss)
-            if stop_loss_enabled and pnl_pct <= -stop_loss_pct:
+            if trigger < 0:
                 actions.append({
                     'action': 'stop_loss',
                     'coin': coin,
@@ -188,7 +282,7 @@ class RiskManager:
                 })
             
             # Check take profit (user-configured percentage gain)
-            elif take_profit_enabled and pnl_pct >= take_profit_pct:
+            else:
                 actions.append({
                     'action': 'take_profit',
                     'coin': coin,
@@ -201,28 +295,110 @@ class RiskManager:
         
         return actions
     
+    def _get_okx_client(self, model: Dict):
+        """Get the OKX client for this model, reusing it while credentials are unchanged"""
+        key = hashlib.sha256(f"{self.model_id}:{model['okx_api_key']}".encode()).hexdigest()
+        if self._okx_client is None or self._okx_client_key != key:
+            from okx_client import OKXClient
+            self._stop_positions_stream()
+            self._okx_client = OKXClient(
+                api_key=model['okx_api_key'],
+                secret_key=model['okx_secret_key'],
+                passphrase=model['okx_passphrase'],
+                sandbox=model.get('okx_sandbox', True)
+            )
+            self._okx_client_key = key
+            self._pos_cache = (0.0, None)
+        return self._okx_client
+    
+    def _get_exchange_positions(self, model: Dict) -> Dict:
+        """Get active exchange positions keyed by coin
+        
+        Served from the WebSocket-fed positions map once the stream is live,
+        otherwise from a REST call cached for a short window.
+        """
+        okx_client = self._get_okx_client(model)
+        
+        if self._positions_stream is None and not self._positions_stream_unavailable:
+            self._start_positions_stream(okx_client)
+        if self._positions_stream is not None and self._positions_stream.ready:
+            return self._positions_map
+        
+        now = time.time()
+        cached_at, positions = self._pos_cache
+        if positions is not None and now - cached_at < self._pos_cache_ttl:
+            return positions
+        
+        positions = {}
+        for pos in okx_client.get_positions():
+            if abs(float(pos.get('size', 0))) > 0:  # Only active positions
+                symbol = pos['symbol']
+                coin = sys.intern(symbol.replace('-USDT-SWAP', ''))
+                positions[coin] = pos
+        
+        self._pos_cache = (now, positions)
+        return positions
+    
+    def _start_positions_stream(self, okx_client):
+        """Subscribe to OKX position pushes in the background"""
+        try:
+            from okx_client import OKXPositionStream
+            stream = OKXPositionStream(okx_client, self._on_positions_update)
+            stream.start()
+            self._positions_stream = stream
+        except Exception as e:
+            logger.info(f"OKX positions stream unavailable, using REST polling: {e}")
+            self._positions_stream_unavailable = True
+    
+    def _stop_positions_stream(self):
+        """Stop the positions stream and drop its data"""
+        if self._positions_stream is not None:
+            self._positions_stream.stop()
+            self._positions_stream = None
+        with self._positions_lock:
+            self._positions_map = {}
+    
+    def close(self):
+        """Stop the positions stream for good; later checks fall back to REST polling"""
+        self._positions_stream_unavailable = True
+        self._stop_positions_stream()
+    
+    def _on_positions_update(self, positions: List[Dict], snapshot: bool):
+        """Apply a positions push from the stream thread"""
+        with self._positions_lock:
+            # Build a new dict and swap it in so readers never see a partial update
+            positions_map = {} if snapshot else dict(self._positions_map)
+            for pos in positions:
+                coin = sys.intern(pos['symbol'].replace('-USDT-SWAP', ''))
+                if pos['size'] > 0:
+                    positions_map[coin] = pos
+                else:
+                    positions_map.pop(coin, None)
+            self._positions_map = positions_map
+    
     def _calculate_total_risk(self, portfolio: Dict) -> float:
         """Calculate total portfolio risk exposure"""
-        total_margin = 0
         account_value = portfolio.get('total_value', 0)
+        positions = portfolio.get('positions', [])
         
-        for position in portfolio.get('positions', []):
-            position_value = position['quantity'] * position['avg_price']
-            margin = position_value / position.get('leverage', 1)
-            total_margin += margin
+        total = total_margin(
+            as_array([p['quantity'] for p in positions]),
+            as_array([p['avg_price'] for p in positions]),
+            as_array([p.get('leverage', 1) for p in positions])
+        )
         
-        return total_margin / account_value if account_value > 0 else 0
+        return total / account_value if account_value > 0 else 0
     
     def _get_daily_trade_count(self) -> int:
         """Get number of trades executed today"""
         try:
-            today = datetime.now().date()
+            # ISO timestamps start with the date, so a prefix compare is enough
+            today_prefix = date.today().isoformat()
             trades = self.db.get_trades(self.model_id, limit=100)
             
             daily_count = 0
             for trade in trades:
-                trade_date = datetime.fromisoformat(trade['timestamp']).date()
-                if trade_date == today:
+                if trade['timestamp'][:10] == today_prefix:
                     daily_count += 1
                 else:
                     break  # Trades are ordered by timestamp desc
@@ -247,10 +423,11 @@ class RiskManager:
             if not history:
                 return 0
             
-            peak_value = max([h['total_value'] for h in history] + [initial_capital])
-            drawdown = (peak_value - current_value) / peak_value
-            
-            return max(0, drawdown)
+            return drawdown(
+                as_array([h['total_value'] for h in history]),
+                float(initial_capital),
+                float(current_value)
+            )
         except Exception as e:
             logger.error(f"Error calculating drawdown: {e}")
             return 0
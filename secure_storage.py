@@ -3,8 +3,12 @@ Secure storage module for API credentials encryption
 """
 import os
 import base64
+import logging
+import threading
 from typing import Optional, Tuple
 
+logger = logging.getLogger(__name__)
+
 try:
     from cryptography.fernet import Fernet
     from cryptography.hazmat.primitives import hashes
@@ -12,7 +16,50 @@ try:
     CRYPTO_AVAILABLE = True
 except ImportError:
     CRYPTO_AVAILABLE = False
-    print("[WARNING] cryptography library not available, using plain text storage")
+    logger.warning("cryptography library not available, using plain text storage")
+
+
+# Per-thread Fernet instances, keyed by derived key
+_TLS = threading.local()
+
+
+def _get_fernet(key: bytes) -> 'Fernet':
+    """Return this thread's Fernet instance for `key`, creating it on first use"""
+    fernets = getattr(_TLS, 'fernets', None)
+    if fernets is None:
+        fernets = _TLS.fernets = {}
+    fernet = fernets.get(key)
+    if fernet is None:
+        fernet = fernets[key] = Fernet(key)
+    return fernet
+
+
+def _pack_credentials(api_key: str, secret_key: str, passphrase: str) -> bytearray:
+    """Join credentials as 'key:secret:passphrase' in a buffer that can be wiped"""
+    buf = bytearray()
+    buf += api_key.encode()
+    buf += b':'
+    buf += secret_key.encode()
+    buf += b':'
+    buf += passphrase.encode()
+    return buf
+
+
+def _unpack_credentials(buf: bytearray) -> Optional[Tuple[str, str, str]]:
+    """Split a 'key:secret:passphrase' buffer into fresh strs"""
+    parts = buf.split(b':', 2)
+    if len(parts) != 3:
+        return None
+    try:
+        return tuple(part.decode('utf-8') for part in parts)
+    finally:
+        for part in parts:
+            _wipe(part)
+
+
+def _wipe(buf: bytearray):
+    """Overwrite a plaintext buffer with zeros"""
+    buf[:] = bytes(len(buf))
 
 
 class SecureStorage:
@@ -20,11 +67,18 @@ class SecureStorage:
     
     def __init__(self, password: str = None):
         self.password = password or self._get_default_password()
-        self._fernet = None
+        self._key = None
         
         if CRYPTO_AVAILABLE:
             self._init_encryption()
     
+    @property
+    def _fernet(self):
+        """Fernet instance for the calling thread, or None without encryption"""
+        if self._key is None:
+            return None
+        return _get_fernet(self._key)
+    
     def _get_default_password(self) -> str:
         """Get default password from environment or generate one"""
         # Try to get from environment variable
@@ -56,29 +110,31 @@ class SecureStorage:
             )
             
             key = base64.urlsafe_b64encode(kdf.derive(password_bytes))
-            self._fernet = Fernet(key)
+            _get_fernet(key)  # validate the key up front
+            self._key = key
             
         except Exception as e:
-            print(f"[WARNING] Failed to initialize encryption: {e}")
-            self._fernet = None
+            logger.warning("Failed to initialize encryption: %s", e)
+            self._key = None
     
     def encrypt_credentials(self, api_key: str, secret_key: str, passphrase: str) -> str:
         """Encrypt API credentials"""
-        if not CRYPTO_AVAILABLE or not self._fernet:
-            # Fallback to base64 encoding (not secure, but better than plain text)
-            credentials = f"{api_key}:{secret_key}:{passphrase}"
-            return base64.b64encode(credentials.encode()).decode()
-        
+        credentials = _pack_credentials(api_key, secret_key, passphrase)
         try:
-            credentials = f"{api_key}:{secret_key}:{passphrase}"
-            encrypted = self._fernet.encrypt(credentials.encode())
-            return base64.urlsafe_b64encode(encrypted).decode()
+            if not CRYPTO_AVAILABLE or not self._fernet:
+                # Fallback to base64 encoding (not secure, but better than plain text)
+                return base64.b64encode(credentials).decode()
             
-        except Exception as e:
-            print(f"[ERROR] Failed to encrypt credentials: {e}")
-            # Fallback to base64
-            credentials = f"{api_key}:{secret_key}:{passphrase}"
-            return base64.b64encode(credentials.encode()).decode()
+            try:
+                encrypted = self._fernet.encrypt(bytes(credentials))
+                return base64.urlsafe_b64encode(encrypted).decode()
+                
+            except Exception as e:
+                logger.error("Failed to encrypt credentials: %s", e)
+                # Fallback to base64
+                return base64.b64encode(credentials).decode()
+        finally:
+            _wipe(credentials)
     
     def decrypt_credentials(self, encrypted_data: str) -> Tuple[str, str, str]:
         """Decrypt API credentials"""
@@ -100,11 +156,13 @@ class SecureStorage:
             # Try Fernet decryption first
             try:
                 encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode())
-                decrypted = self._fernet.decrypt(encrypted_bytes)
-                credentials = decrypted.decode('utf-8')
-                parts = credentials.split(':', 2)
-                if len(parts) == 3:
-                    return parts[0], parts[1], parts[2]
+                decrypted = bytearray(self._fernet.decrypt(encrypted_bytes))
+                try:
+                    parts = _unpack_credentials(decrypted)
+                finally:
+                    _wipe(decrypted)
+                if parts:
+                    return parts
             except Exception:
                 # Fallback to base64 decoding
                 try:
@@ -118,7 +176,7 @@ class SecureStorage:
             return "", "", ""
             
         except Exception as e:
-            print(f"[WARNING] Credential decrypt failed: {e}")
+            logger.warning("Credential decrypt failed: %s", e)
             return "", "", ""
     
     def encrypt_single_value(self, value: str) -> str:
@@ -133,7 +191,7 @@ class SecureStorage:
             encrypted = self._fernet.encrypt(value.encode())
             return base64.urlsafe_b64encode(encrypted).decode()
         except Exception as e:
-            print(f"[ERROR] Failed to encrypt value: {e}")
+            logger.error("Failed to encrypt value: %s", e)
             return base64.b64encode(value.encode()).decode()
     
     def decrypt_single_value(self, encrypted_value: str) -> str:
@@ -163,7 +221,7 @@ class SecureStorage:
                     return encrypted_value
                 
         except Exception as e:
-            print(f"[WARNING] Decrypt failed, using original value: {e}")
+            logger.warning("Decrypt failed, using original value: %s", e)
             return encrypted_value
 
 
@@ -2,9 +2,32 @@
 """
 Safe startup script for AI Trading Platform
 """
+import atexit
+import logging
 import os
+import queue
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from logging.handlers import QueueHandler, QueueListener
+
+def setup_logging():
+    """Route log records through a queue so logging never blocks on stream writes"""
+    root = logging.getLogger()
+    if not root.handlers:
+        logging.basicConfig(level=logging.INFO)
+    
+    # Move the real handlers behind a listener thread; callers only enqueue
+    handlers = root.handlers[:]
+    for handler in handlers:
+        root.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
 def check_dependencies():
     """Check if all required dependencies are available"""
@@ -23,19 +46,22 @@ def check_dependencies():
     missing_required = []
     missing_optional = []
     
+    # Only locate the modules (all at once); the app imports them for real later
+    all_modules = required_modules + optional_modules
+    with ThreadPoolExecutor(max_workers=len(all_modules)) as executor:
+        available = dict(zip(all_modules, executor.map(lambda m: find_spec(m) is not None, all_modules)))
+    
     for module in required_modules:
-        try:
-            __import__(module)
+        if available[module]:
             print(f"  ✓ {module}")
-        except ImportError:
+        else:
             missing_required.append(module)
             print(f"  ✗ {module} (required)")
     
     for module in optional_modules:
-        try:
-            __import__(module)
+        if available[module]:
             print(f"  ✓ {module}")
-        except ImportError:
+        else:
             missing_optional.append(module)
             print(f"  ⚠ {module} (optional - will use fallback)")
     
@@ -128,6 +154,8 @@ def main():
     print("🤖 AI Trading Platform Startup")
     print("=" * 40)
     
+    setup_logging()
+    
     # Check dependencies
     if not check_dependencies():
         sys.exit(1)
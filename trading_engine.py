@@ -1,25 +1,110 @@
-from datetime import datetime
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from importlib import import_module
+from typing import Dict, List, Optional
 import json
+import logging
+import math
+import sys
+import threading
 import time
 
-# Import OKX client (optional dependency)
+# Faster JSON encoding for conversation logs (optional dependency)
 try:
-    from okx_client import OKXClient
-    OKX_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    OKX_AVAILABLE = False
-    print("[INFO] OKX client not available, using simulation mode")
+    ORJSON_AVAILABLE = False
 
-# Import new modules
+# Vectorized P&L when several positions close at once (optional dependency)
 try:
-    from risk_manager import RiskManager
-    from enhanced_prompts import get_enhanced_trading_prompt
-    from monitoring import get_monitor
-    ENHANCED_FEATURES = True
+    import numpy as np
+    NUMPY_AVAILABLE = True
 except ImportError:
-    ENHANCED_FEATURES = False
-    print("[INFO] Enhanced features not available, using basic functionality")
+    NUMPY_AVAILABLE = False
+
+def _dumps(obj) -> str:
+    """Serialize to JSON text, keeping non-ASCII characters as-is"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
+
+logger = logging.getLogger(__name__)
+
+def cached_import(module_path: str, class_name: str):
+    """Import `class_name` from `module_path`, skipping the import machinery once loaded"""
+    # Same check as django.utils.module_loading.cached_import
+    modules = sys.modules
+    if module_path not in modules or (
+        # Module is not fully initialized.
+        getattr(modules[module_path], '__spec__', None) is not None
+        and getattr(modules[module_path].__spec__, '_initializing', False) is True
+    ):
+        import_module(module_path)
+    return getattr(modules[module_path], class_name)
+
+@lru_cache(maxsize=None)
+def _get_enhanced_features():
+    """Return (RiskManager, get_monitor), or None if the enhanced modules are unavailable"""
+    try:
+        return cached_import('risk_manager', 'RiskManager'), cached_import('monitoring', 'get_monitor')
+    except ImportError:
+        logger.info("Enhanced features not available, using basic functionality")
+        return None
+
+# Local timestamp format shown to the AI
+_TS_FMT = '%Y-%m-%d %H:%M:%S'
+
+# Summary logged as the conversation's user prompt
+_PROMPT_TEMPLATE = "Market State: {} coins, Portfolio: {} positions"
+
+# Close-result messages for positions OKX no longer holds, by reason
+_ALREADY_CLOSED_MSGS = {
+    'phantom_db': "Cleaned up phantom position for {} (already closed on exchange)",
+    'zero_size_exchange': "Position for {} already closed on exchange, database synced",
+    'already_closed_okx': "Position for {} already closed on OKX, database cleaned up"
+}
+
+# How often (seconds) a running engine re-reads its model's settings
+MODEL_CONFIG_TTL = 60
+
+# How long an AI decision may be reused while the market fingerprint is unchanged
+DECISION_REUSE_SECONDS = 900
+
+# How long (seconds) one OKX positions snapshot serves sync, stop loss and close
+POSITIONS_CACHE_TTL = 5
+
+# Most OKX close requests one batch keeps in flight at once
+MAX_OKX_CLOSE_WORKERS = 8
+
+# Pools shared by every engine, so engines replaced on a model edit leave no threads behind:
+# per-coin price-history fetches, and a single writer that keeps each model's conversation log in order
+INDICATOR_FETCH_WORKERS = 16
+_INDICATOR_POOL = ThreadPoolExecutor(max_workers=INDICATOR_FETCH_WORKERS, thread_name_prefix='indicators')
+_LOG_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversations')
+
+
+def _close_result(coin: str, quantity: float, price: float, pnl: float,
+                  message: str, **extra) -> Dict:
+    """Execution result of a close_position decision"""
+    return {'coin': coin, 'signal': 'close_position', 'quantity': quantity,
+            'price': price, 'pnl': pnl, **extra, 'message': message}
+
+
+class PositionSnapshot:
+    """An OKX position with its numeric fields parsed once (avg_price is None if OKX omits it)"""
+    
+    __slots__ = ('symbol', 'side', 'size', 'avg_price', 'leverage')
+    
+    def __init__(self, pos: Dict):
+        self.symbol = pos['symbol']
+        self.side = pos.get('side', 'long')
+        self.size = float(pos.get('size', 0))
+        avg_price = pos.get('avg_price')
+        self.avg_price = float(avg_price) if avg_price is not None else None
+        self.leverage = int(float(pos.get('leverage', 1)))
+
 
 class TradingEngine:
     def __init__(self, model_id: int, db, market_fetcher, ai_trader, okx_client=None):
@@ -30,28 +115,35 @@ class TradingEngine:
         self.okx_client = okx_client
         
         # Initialize enhanced features
-        if ENHANCED_FEATURES:
+        enhanced_features = _get_enhanced_features()
+        if enhanced_features:
+            RiskManager, get_monitor = enhanced_features
             self.risk_manager = RiskManager(model_id, db)
             self.monitor = get_monitor(db)
-            print(f"[INFO] Risk management enabled for model {model_id}")
+            logger.info("Risk management enabled for model %s", model_id)
         else:
             self.risk_manager = None
             self.monitor = None
-            print(f"[INFO] Enhanced features not available for model {model_id}")
+            logger.info("Enhanced features not available for model %s", model_id)
         
         # Load model configuration
         model = self.db.get_model(model_id)
         if model:
             # Parse trading coins from configuration
             trading_coins_str = model.get('trading_coins', 'BTC,ETH,SOL,BNB,XRP,DOGE')
-            self.coins = [coin.strip() for coin in trading_coins_str.split(',') if coin.strip()]
+            # Read-only tuple of interned symbols, so per-coin dict lookups
+            # downstream compare by identity
+            self.coins = tuple(filter(None, (sys.intern(coin.strip()) for coin in trading_coins_str.split(','))))
             self.auto_trading_enabled = model.get('auto_trading_enabled', True)
             self.system_prompt = model.get('system_prompt', '')
+            self.initial_capital = model['initial_capital']
         else:
             # Fallback to default values
-            self.coins = ['BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE']
+            self.coins = ('BTC', 'ETH', 'SOL', 'BNB', 'XRP', 'DOGE')
             self.auto_trading_enabled = True
             self.system_prompt = ''
+            self.initial_capital = None
+        self._model_config_time = time.monotonic()  # when the settings above were read
         
         # OKX symbol mapping (使用永续合约以支持杠杆交易)
         self.okx_symbols = {
@@ -62,79 +154,156 @@ class TradingEngine:
             'XRP': 'XRP-USDT-SWAP',
             'DOGE': 'DOGE-USDT-SWAP'
         }
+        # Reverse map for exchange responses; other instruments are ignored
+        self.coin_from_symbol = {symbol: coin for coin, symbol in self.okx_symbols.items()}
+        # OKX symbols for the coins this model trades
+        self._sym = {coin: self.okx_symbols[coin] for coin in self.coins if coin in self.okx_symbols}
+        self._coin_set = frozenset(self.coins)
+        
+        # Decision signal -> handler
+        self._dispatch = {
+            'buy_to_enter': self._execute_buy,
+            'sell_to_enter': self._execute_sell,
+            'close_position': self._execute_close,
+            'hold': self._hold
+        }
+        
+        # The per-cycle state below lives on the engine, so cycles must not overlap
+        self._cycle_lock = threading.Lock()
+        
+        # Simulated trades are mirrored onto the cycle's portfolio snapshot;
+        # OKX trades mark it stale so it is re-read once at the end
+        self._portfolio_lock = threading.Lock()
+        self._portfolio_stale = False
+        self._positions_by_coin = {}  # first position per coin in the cycle's snapshot
+        
+        # Last OKX positions response; dropped whenever an order changes positions
+        self._positions_lock = threading.Lock()
+        self._positions_cache = None
+        self._positions_cache_ts = 0.0
+        self._positions_index = (None, {}, {})  # (response it indexes, first position per symbol, first open one)
+        self._last_sync_time = 0.0  # last throttled position sync
+        self._synced_this_cycle = False  # STEP 0 sync already ran for the current cycle
+        
+        # Last AI decision and the market/position fingerprint it was made for
+        self._last_fingerprint = None
+        self._last_decisions = None
+        self._last_decision_time = 0.0
+    
+    def close(self):
+        """Release the engine's background resources; call before dropping it"""
+        if self.risk_manager:
+            self.risk_manager.close()
     
     def execute_trading_cycle(self) -> Dict:
+        # A manual run waits for a scheduled cycle of the same engine (and vice versa)
+        with self._cycle_lock:
+            return self._run_trading_cycle()
+    
+    def _run_trading_cycle(self) -> Dict:
         try:
-            market_state = self._get_market_state()
+            self._refresh_model_config()
+            market_state, current_prices = self._get_market_state()
 
-            current_prices = {coin: market_state[coin]['price'] for coin in market_state}
+            portfolio = self.db.get_portfolio(self.model_id, current_prices)
+            self._portfolio_stale = False
 
             # 🔄 STEP 0: Sync positions with exchange (before any operations)
             # 确保数据库持仓与OKX实际持仓一致
             if self.okx_client:
-                self.sync_positions_with_exchange()
-
-            portfolio = self.db.get_portfolio(self.model_id, current_prices)
+                self.sync_positions_with_exchange(portfolio=portfolio)
+                self._synced_this_cycle = True
+                if self._portfolio_stale:
+                    portfolio = self.db.get_portfolio(self.model_id, current_prices)
+                    self._portfolio_stale = False
+            else:
+                # Private copy: simulated trades below update it in place
+                portfolio = dict(portfolio, positions=[dict(pos) for pos in portfolio['positions']])
+            self._index_positions(portfolio)
 
             # 🚨 STEP 1: Check for stop loss and take profit triggers
             stop_loss_actions = []
-            if ENHANCED_FEATURES and self.risk_manager:
+            if self.risk_manager:
                 stop_loss_actions = self.risk_manager.check_stop_loss_take_profit(portfolio, current_prices)
                 
                 # Execute stop loss/take profit actions immediately
                 if stop_loss_actions:
-                    print(f"[RISK] Model {self.model_id}: Executing {len(stop_loss_actions)} stop loss/take profit actions")
-                    for action in stop_loss_actions:
+                    logger.warning("[RISK] Model %s: Executing %d stop loss/take profit actions",
+                                   self.model_id, len(stop_loss_actions))
+                    self._last_fingerprint = None
+                    if self.okx_client:
+                        # Exchange round-trips dominate: one worker per position
                         try:
-                            result = self._execute_stop_loss_take_profit(action, current_prices)
-                            if self.monitor:
-                                self.monitor.log_trading_event(
-                                    self.model_id, 
-                                    'stop_loss_executed' if action['action'] == 'stop_loss' else 'take_profit_executed',
-                                    {
-                                        'coin': action['coin'],
-                                        'reason': action['reason'],
-                                        'quantity': action['quantity'],
-                                        'result': result
-                                    }
-                                )
+                            okx_pos_by_symbol = self._positions_by_symbol(nonzero_only=True)
                         except Exception as e:
-                            print(f"[ERROR] Failed to execute {action['action']} for {action['coin']}: {e}")
-                            if self.monitor:
-                                self.monitor.log_trading_event(self.model_id, 'stop_loss_error', {
-                                    'coin': action['coin'],
-                                    'error': str(e)
-                                })
+                            # Each action retries the fetch and reports its own error
+                            logger.warning("OKX positions prefetch failed: %s", e)
+                            okx_pos_by_symbol = None
+                        with ThreadPoolExecutor(max_workers=len(stop_loss_actions)) as pool:
+                            for action in stop_loss_actions:
+                                pool.submit(self._run_stop_loss_action, action, current_prices,
+                                            portfolio, okx_pos_by_symbol)
+                    else:
+                        # Simulated closes are database-only: run them in one transaction
+                        with self.db.transaction():
+                            for action in stop_loss_actions:
+                                self._run_stop_loss_action(action, current_prices, portfolio)
             
-            # Refresh portfolio after stop loss/take profit execution
-            if stop_loss_actions:
+            # Refresh portfolio if stop loss/take profit changed positions on the exchange
+            if self._portfolio_stale:
                 portfolio = self.db.get_portfolio(self.model_id, current_prices)
+                self._portfolio_stale = False
+                self._index_positions(portfolio)
             
             account_info = self._build_account_info(portfolio)
             
-            # 🤖 STEP 2: Get AI trading decisions
-            decisions = self.ai_trader.make_decision(
-                market_state, portfolio, account_info
-            )
-            
-            self.db.add_conversation(
-                self.model_id,
-                user_prompt=self._format_prompt(market_state, portfolio, account_info),
-                ai_response=json.dumps(decisions, ensure_ascii=False),
-                cot_trace=''
+            # 🤖 STEP 2: Get AI trading decisions (reused while nothing material changed)
+            fingerprint = self._decision_fingerprint(market_state, portfolio)
+            reused = (
+                fingerprint == self._last_fingerprint
+                and time.time() - self._last_decision_time < DECISION_REUSE_SECONDS
             )
+            if reused:
+                decisions = self._last_decisions
+                logger.info("Model %s: market unchanged, reusing last AI decision", self.model_id)
+            else:
+                decisions = self.ai_trader.make_decision(
+                    market_state, portfolio, account_info
+                )
+                self._last_fingerprint = fingerprint
+                self._last_decisions = decisions
+                self._last_decision_time = time.time()
+                # Summarized before execution changes the position count
+                user_prompt = self._format_prompt(market_state, portfolio, account_info)
             
-            # 🎯 STEP 3: Execute AI trading decisions (with risk validation)
-            execution_results = self._execute_decisions(decisions, market_state, portfolio)
+            # Simulated cycles commit all their writes at once; OKX cycles make
+            # network calls between writes, so they keep per-call commits
+            # rather than hold the SQLite write lock across them
+            with self.db.transaction() if not self.okx_client else nullcontext():
+                # 🎯 STEP 3: Execute AI trading decisions (with risk validation)
+                execution_results = self._execute_decisions(decisions, market_state, portfolio)
+                
+                # A decision that traded must not be replayed: OKX fills can leave the
+                # fingerprint unchanged (cached positions), so ask the AI again next cycle
+                if any('error' not in result and result.get('signal') != 'hold'
+                       for result in execution_results):
+                    self._last_fingerprint = None
+                
+                # 📊 STEP 4: Update portfolio and record metrics
+                if self._portfolio_stale:
+                    updated_portfolio = self.db.get_portfolio(self.model_id, current_prices)
+                else:
+                    updated_portfolio = portfolio
+                self.db.record_account_value(
+                    self.model_id,
+                    updated_portfolio['total_value'],
+                    updated_portfolio['cash'],
+                    updated_portfolio['positions_value']
+                )
             
-            # 📊 STEP 4: Update portfolio and record metrics
-            updated_portfolio = self.db.get_portfolio(self.model_id, current_prices)
-            self.db.record_account_value(
-                self.model_id,
-                updated_portfolio['total_value'],
-                updated_portfolio['cash'],
-                updated_portfolio['positions_value']
-            )
+            # Serializing and storing the conversation happens off the trading path
+            if not reused:
+                _LOG_EXECUTOR.submit(self._persist_conversation, user_prompt, decisions)
             
             return {
                 'success': True,
@@ -145,73 +314,177 @@ class TradingEngine:
             }
             
         except Exception as e:
-            print(f"[ERROR] Trading cycle failed (Model {self.model_id}): {e}")
-            import traceback
-            print(traceback.format_exc())
+            logger.error("Trading cycle failed (Model %s): %s", self.model_id, e, exc_info=True)
             return {
                 'success': False,
                 'error': str(e)
             }
+        finally:
+            self._synced_this_cycle = False
+    
+    def _refresh_model_config(self):
+        """Re-read settings that can change without an engine restart, at most every MODEL_CONFIG_TTL"""
+        now = time.monotonic()
+        if now - self._model_config_time < MODEL_CONFIG_TTL:
+            return
+        self._model_config_time = now
+        
+        model = self.db.get_model(self.model_id)
+        if model:
+            self.initial_capital = model['initial_capital']
+            self.auto_trading_enabled = model.get('auto_trading_enabled', True)
+            self.system_prompt = model.get('system_prompt', '')
+    
+    def _get_positions_cached(self, ttl: float = POSITIONS_CACHE_TTL) -> List[PositionSnapshot]:
+        """OKX positions, fetched (and parsed) at most once per `ttl` seconds unless invalidated"""
+        with self._positions_lock:
+            now = time.monotonic()
+            if self._positions_cache is None or now - self._positions_cache_ts >= ttl:
+                # Other strategies' instruments are dropped before parsing
+                coin_from_symbol = self.coin_from_symbol
+                self._positions_cache = [PositionSnapshot(pos) for pos in self.okx_client.get_positions()
+                                         if pos.get('symbol') in coin_from_symbol]
+                self._positions_cache_ts = now
+            return self._positions_cache
+    
+    def _invalidate_positions_cache(self):
+        self._positions_cache = None
+    
+    def _positions_by_symbol(self, nonzero_only: bool = False) -> Dict:
+        """First OKX position per symbol (first open one with nonzero_only)
+        
+        Re-indexed only when the positions cache refreshes.
+        """
+        positions = self._get_positions_cached()
+        indexed, by_symbol, open_by_symbol = self._positions_index
+        if indexed is not positions:
+            by_symbol, open_by_symbol = {}, {}
+            for pos in positions:
+                by_symbol.setdefault(pos.symbol, pos)
+                if pos.size != 0:
+                    open_by_symbol.setdefault(pos.symbol, pos)
+            self._positions_index = (positions, by_symbol, open_by_symbol)
+        return open_by_symbol if nonzero_only else by_symbol
     
-    def _get_market_state(self) -> Dict:
+    @staticmethod
+    def _decision_fingerprint(market_state: Dict, portfolio: Dict) -> tuple:
+        """Rounded prices/RSI per coin plus open positions; equal fingerprints get the same decision"""
+        market = tuple(sorted(
+            (coin, round(state['price'], 2), round(state.get('indicators', {}).get('rsi_14', 0), 1))
+            for coin, state in market_state.items()
+        ))
+        positions = tuple(sorted(
+            (pos['coin'], pos['side'], pos['quantity']) for pos in portfolio['positions']
+        ))
+        return market, positions
+    
+    def _get_market_state(self) -> tuple:
+        """Per-coin prices with indicators, plus the plain {coin: price} map"""
         market_state = {}
+        current_prices = {}
         prices = self.market_fetcher.get_current_prices(self.coins)
         
-        for coin in self.coins:
-            if coin in prices:
-                market_state[coin] = prices[coin].copy()
-                indicators = self.market_fetcher.calculate_technical_indicators(coin)
-                market_state[coin]['indicators'] = indicators
+        # History fetches are network-bound, so they run side by side on the
+        # pool; the indicators are then computed for all coins together
+        coins = [coin for coin in self.coins if coin in prices]
+        indicators = self.market_fetcher.calculate_technical_indicators_batch(coins, _INDICATOR_POOL)
+        # One new dict per coin: the fetcher's price entries are cached and
+        # shared between engines, so they must not be written to
+        for coin in coins:
+            entry = market_state[coin] = dict(prices[coin], indicators=indicators[coin])
+            current_prices[coin] = entry['price']
         
-        return market_state
+        return market_state, current_prices
     
-    def _execute_stop_loss_take_profit(self, action: Dict, current_prices: Dict) -> Dict:
+    def _persist_conversation(self, user_prompt: str, decisions: Dict):
+        """Store an AI exchange in the conversation log (runs on the log executor)"""
+        try:
+            self.db.add_conversation(
+                self.model_id,
+                user_prompt=user_prompt,
+                ai_response=_dumps(decisions),
+                cot_trace=''
+            )
+        except Exception as e:
+            logger.error("Failed to save conversation (Model %s): %s", self.model_id, e)
+    
+    def _run_stop_loss_action(self, action: Dict, current_prices: Dict, portfolio: Dict,
+                              okx_pos_by_symbol: Optional[Dict] = None):
+        """Execute one stop loss/take profit action and record the outcome"""
+        try:
+            result = self._execute_stop_loss_take_profit(
+                action, current_prices, portfolio, okx_pos_by_symbol
+            )
+            if self.monitor:
+                self.monitor.log_trading_event(
+                    self.model_id, 
+                    'stop_loss_executed' if action['action'] == 'stop_loss' else 'take_profit_executed',
+                    {
+                        'coin': action['coin'],
+                        'reason': action['reason'],
+                        'quantity': action['quantity'],
+                        'result': result
+                    }
+                )
+        except Exception as e:
+            logger.error("Failed to execute %s for %s: %s", action['action'], action['coin'], e)
+            if self.monitor:
+                self.monitor.log_trading_event(self.model_id, 'stop_loss_error', {
+                    'coin': action['coin'],
+                    'error': str(e)
+                })
+    
+    def _execute_stop_loss_take_profit(self, action: Dict, current_prices: Dict,
+                                       portfolio: Dict,
+                                       okx_pos_by_symbol: Optional[Dict] = None) -> Dict:
         """Execute stop loss or take profit action"""
         coin = action['coin']
         side = action['side']  # 'sell' for closing long, 'buy' for closing short
         action_type = action['action']  # 'stop_loss' or 'take_profit'
         
-        print(f"[{action_type.upper()}] {coin}: {action['reason']}")
+        logger.warning("[%s] %s: %s", action_type.upper(), coin, action['reason'])
         
         try:
             if self.okx_client:
                 # Get actual position from OKX before closing
-                symbol = self.okx_symbols.get(coin)
+                symbol = self._sym.get(coin)
                 if not symbol:
                     return {'success': False, 'error': f'Unsupported coin: {coin}'}
                 
                 # Find the actual position
-                positions = self.okx_client.get_positions()
-                target_position = None
-                for pos in positions:
-                    if pos['symbol'] == symbol and abs(float(pos.get('size', 0))) > 0:
-                        target_position = pos
-                        break
+                if okx_pos_by_symbol is None:
+                    okx_pos_by_symbol = self._positions_by_symbol(nonzero_only=True)
+                target_position = okx_pos_by_symbol.get(symbol)
                 
                 if not target_position:
                     # Position already closed or doesn't exist
-                    print(f"[{action_type.upper()}] No active position found for {coin}")
+                    logger.warning("[%s] No active position found for %s", action_type.upper(), coin)
                     return {
                         'success': False,
                         'error': f'No active position found for {coin}'
                     }
                 
                 # Get actual quantity from position
-                actual_quantity = abs(float(target_position.get('size', 0)))
+                actual_quantity = abs(target_position.size)
                 
                 # Execute close position instead of placing a separate order
                 close_result = self.okx_client.close_position(symbol=symbol)
+                self._invalidate_positions_cache()
 
                 if close_result['success']:
                     current_price = current_prices.get(coin, 0)
-                    entry_price = float(target_position.get('avg_price', current_price))
-                    position_side = target_position.get('side', 'long')
+                    entry_price = target_position.avg_price
+                    if entry_price is None:
+                        entry_price = current_price
+                    position_side = target_position.side
+
+                    self._portfolio_stale = True
 
                     # Check if position was already closed
                     if close_result.get('already_closed'):
                         # Position already closed - just clean up database
                         self.db.close_position(self.model_id, coin, position_side)
-                        print(f"[INFO] Cleaned up phantom position for {coin} - already closed on OKX")
+                        logger.info("Cleaned up phantom position for %s - already closed on OKX", coin)
 
                         return {
                             'success': True,
@@ -220,18 +493,12 @@ class TradingEngine:
                         }
 
                     # Position was actually closed now - calculate P&L
-                    if position_side == 'long':
-                        pnl = (current_price - entry_price) * actual_quantity
-                    else:  # short position
-                        pnl = (entry_price - current_price) * actual_quantity
-
-                    # Close position in database
-                    self.db.close_position(self.model_id, coin, position_side)
-
-                    # Record the trade with actual values and correct side
-                    self.db.add_trade(
-                        self.model_id, coin, 'close_position', actual_quantity,
-                        current_price, 1, position_side, pnl=pnl
+                    pnl = self._close_pnl(position_side, entry_price, current_price, actual_quantity)
+
+                    # Close position and record the trade in one transaction
+                    self.db.close_and_record_trade(
+                        self.model_id, coin, position_side, actual_quantity,
+                        current_price, 1, pnl=pnl
                     )
 
                     return {
@@ -251,12 +518,7 @@ class TradingEngine:
             current_price = current_prices.get(coin, 0)
             
             # Calculate P&L for the closed position
-            portfolio = self.db.get_portfolio(self.model_id, current_prices)
-            position = None
-            for pos in portfolio.get('positions', []):
-                if pos['coin'] == coin:
-                    position = pos
-                    break
+            position = self._positions_by_coin.get(coin)
             
             pnl = 0
             quantity = action.get('quantity', 0)  # Get quantity from action
@@ -266,20 +528,14 @@ class TradingEngine:
                 entry_price = position['avg_price']
                 position_side = position['side']
                 quantity = position['quantity']  # Use actual position quantity
-                
-                if position_side == 'long':
-                    pnl = (current_price - entry_price) * quantity
-                else:
-                    pnl = (entry_price - current_price) * quantity
+                pnl = self._close_pnl(position_side, entry_price, current_price, quantity)
             
-            # Close position in database
-            self.db.close_position(self.model_id, coin, position_side)
-            
-            # Record the trade with correct position side
-            self.db.add_trade(
-                self.model_id, coin, 'close_position', quantity,
-                current_price, 1, position_side, pnl=pnl
+            # Close position and record the trade in one transaction
+            self.db.close_and_record_trade(
+                self.model_id, coin, position_side, quantity,
+                current_price, 1, pnl=pnl
             )
+            self._remove_position_from_portfolio(portfolio, coin, position_side, pnl)
             
             return {
                 'success': True,
@@ -296,50 +552,62 @@ class TradingEngine:
             }
     
     def _build_account_info(self, portfolio: Dict) -> Dict:
-        model = self.db.get_model(self.model_id)
-        initial_capital = model['initial_capital']
+        initial_capital = self.initial_capital
         total_value = portfolio['total_value']
         total_return = ((total_value - initial_capital) / initial_capital) * 100
         
         return {
-            'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'current_time': time.strftime(_TS_FMT),
             'total_return': total_return,
             'initial_capital': initial_capital
         }
     
     def _format_prompt(self, market_state: Dict, portfolio: Dict, 
                       account_info: Dict) -> str:
-        return f"Market State: {len(market_state)} coins, Portfolio: {len(portfolio['positions'])} positions"
+        return _PROMPT_TEMPLATE.format(len(market_state), len(portfolio['positions']))
     
     def _execute_decisions(self, decisions: Dict, market_state: Dict, 
                           portfolio: Dict) -> list:
-        results = []
+        # Drop coins this model doesn't trade, then fill a result slot per decision
+        items = [(coin, decision) for coin, decision in decisions.items() if coin in self._coin_set]
+        results = [None] * len(items)
         
-        for coin, decision in decisions.items():
-            if coin not in self.coins:
-                continue
+        signals = [decision.get('signal', '').lower() for _, decision in items]
+        
+        dispatch = self._dispatch
+        i = 0
+        while i < len(items):
+            coin, decision = items[i]
+            signal = signals[i]
             
-            signal = decision.get('signal', '').lower()
+            # A run of consecutive OKX closes goes out as one batch, keeping decision order
+            if self.okx_client and signal == 'close_position':
+                end = i + 1
+                while end < len(items) and signals[end] == 'close_position':
+                    end += 1
+                if end - i > 1:
+                    coins = [close_coin for close_coin, _ in items[i:end]]
+                    results[i:end] = self._execute_okx_closes(coins, market_state, portfolio)
+                    i = end
+                    continue
             
             try:
-                if signal == 'buy_to_enter':
-                    result = self._execute_buy(coin, decision, market_state, portfolio)
-                elif signal == 'sell_to_enter':
-                    result = self._execute_sell(coin, decision, market_state, portfolio)
-                elif signal == 'close_position':
-                    result = self._execute_close(coin, decision, market_state, portfolio)
-                elif signal == 'hold':
-                    result = {'coin': coin, 'signal': 'hold', 'message': 'Hold position'}
+                handler = dispatch.get(signal)
+                if handler:
+                    results[i] = handler(coin, decision, market_state, portfolio)
                 else:
-                    result = {'coin': coin, 'error': f'Unknown signal: {signal}'}
-                
-                results.append(result)
+                    results[i] = {'coin': coin, 'error': f'Unknown signal: {signal}'}
                 
             except Exception as e:
-                results.append({'coin': coin, 'error': str(e)})
+                results[i] = {'coin': coin, 'error': str(e)}
+            i += 1
         
         return results
     
+    @staticmethod
+    def _hold(coin: str, decision: Dict, market_state: Dict, portfolio: Dict) -> Dict:
+        return {'coin': coin, 'signal': 'hold', 'message': 'Hold position'}
+    
     def _execute_buy(self, coin: str, decision: Dict, market_state: Dict, 
                     portfolio: Dict) -> Dict:
         quantity = float(decision.get('quantity', 0))
@@ -350,45 +618,57 @@ class TradingEngine:
             return {'coin': coin, 'error': 'Invalid quantity'}
         
         # 🛡️ Risk validation if enhanced features available
-        if ENHANCED_FEATURES and self.risk_manager:
-            validation = self.risk_manager.validate_order(
-                coin, 'buy', quantity, leverage, price, portfolio
-            )
-            
-            if not validation['valid']:
-                error_msg = f"Risk validation failed: {'; '.join(validation['errors'])}"
-                print(f"[RISK] {error_msg}")
-                if self.monitor:
-                    self.monitor.log_trading_event(self.model_id, 'risk_violation', {
-                        'coin': coin,
-                        'message': error_msg,
-                        'errors': validation['errors']
-                    })
-                return {'coin': coin, 'error': error_msg}
-            
-            # Apply risk adjustments
-            if validation['warnings']:
-                print(f"[RISK] Adjustments applied: {'; '.join(validation['warnings'])}")
-                quantity = validation['adjusted_quantity']
-                leverage = validation['adjusted_leverage']
+        quantity, leverage, error = self._validate_and_adjust('buy', coin, quantity, leverage, price, portfolio)
+        if error:
+            return error
         
         # Use OKX API if available, otherwise fallback to simulation
         if self.okx_client:
-            return self._execute_okx_buy(coin, quantity, leverage, price)
+            result = self._execute_okx_buy(coin, quantity, leverage, price)
+            if 'error' not in result:
+                self._portfolio_stale = True
+            return result
         else:
             return self._execute_simulated_buy(coin, quantity, leverage, price, portfolio)
     
+    def _validate_and_adjust(self, side: str, coin: str, quantity: float, leverage: int,
+                             price: float, portfolio: Dict):
+        """Run risk validation; returns (quantity, leverage, error result or None)"""
+        if not self.risk_manager:
+            return quantity, leverage, None
+        
+        validation = self.risk_manager.validate_order(
+            coin, side, quantity, leverage, price, portfolio
+        )
+        
+        if not validation.valid:
+            error_msg = f"Risk validation failed: {'; '.join(validation.errors)}"
+            logger.warning("[RISK] %s", error_msg)
+            if self.monitor:
+                self.monitor.log_trading_event(self.model_id, 'risk_violation', {
+                    'coin': coin,
+                    'message': error_msg,
+                    'errors': validation.errors
+                })
+            return quantity, leverage, {'coin': coin, 'error': error_msg}
+        
+        # Apply risk adjustments
+        if validation.warnings:
+            logger.warning("[RISK] Adjustments applied: %s", '; '.join(validation.warnings))
+            return validation.adjusted_quantity, validation.adjusted_leverage, None
+        
+        return quantity, leverage, None
+    
     def _execute_okx_buy(self, coin: str, quantity: float, leverage: int, price: float) -> Dict:
         """Execute buy order via OKX API"""
         try:
-            symbol = self.okx_symbols.get(coin)
-            if not symbol:
+            try:
+                symbol = self._sym[coin]
+            except KeyError:
                 return {'coin': coin, 'error': f'Unsupported coin: {coin}'}
             
             # Check account config for debugging (first time only)
-            if not hasattr(self, '_config_checked'):
-                self.okx_client.get_account_config()
-                self._config_checked = True
+            self.okx_client.ensure_config_loaded()
             
             # Place market order on OKX
             order_result = self.okx_client.place_order(
@@ -398,6 +678,7 @@ class TradingEngine:
                 order_type='market',
                 leverage=leverage
             )
+            self._invalidate_positions_cache()
             
             if order_result['success']:
                 # Record trade in database
@@ -439,6 +720,7 @@ class TradingEngine:
             self.model_id, coin, 'buy_to_enter', quantity, 
             price, leverage, 'long', pnl=0
         )
+        self._apply_trade_to_portfolio(portfolio, coin, 'long', quantity, price, leverage)
         
         return {
             'coin': coin,
@@ -459,45 +741,29 @@ class TradingEngine:
             return {'coin': coin, 'error': 'Invalid quantity'}
         
         # 🛡️ Risk validation if enhanced features available
-        if ENHANCED_FEATURES and self.risk_manager:
-            validation = self.risk_manager.validate_order(
-                coin, 'sell', quantity, leverage, price, portfolio
-            )
-            
-            if not validation['valid']:
-                error_msg = f"Risk validation failed: {'; '.join(validation['errors'])}"
-                print(f"[RISK] {error_msg}")
-                if self.monitor:
-                    self.monitor.log_trading_event(self.model_id, 'risk_violation', {
-                        'coin': coin,
-                        'message': error_msg,
-                        'errors': validation['errors']
-                    })
-                return {'coin': coin, 'error': error_msg}
-            
-            # Apply risk adjustments
-            if validation['warnings']:
-                print(f"[RISK] Adjustments applied: {'; '.join(validation['warnings'])}")
-                quantity = validation['adjusted_quantity']
-                leverage = validation['adjusted_leverage']
+        quantity, leverage, error = self._validate_and_adjust('sell', coin, quantity, leverage, price, portfolio)
+        if error:
+            return error
         
         # Use OKX API if available, otherwise fallback to simulation
         if self.okx_client:
-            return self._execute_okx_sell(coin, quantity, leverage, price)
+            result = self._execute_okx_sell(coin, quantity, leverage, price)
+            if 'error' not in result:
+                self._portfolio_stale = True
+            return result
         else:
             return self._execute_simulated_sell(coin, quantity, leverage, price, portfolio)
     
     def _execute_okx_sell(self, coin: str, quantity: float, leverage: int, price: float) -> Dict:
         """Execute sell order via OKX API"""
         try:
-            symbol = self.okx_symbols.get(coin)
-            if not symbol:
+            try:
+                symbol = self._sym[coin]
+            except KeyError:
                 return {'coin': coin, 'error': f'Unsupported coin: {coin}'}
             
             # Check account config for debugging (first time only)
-            if not hasattr(self, '_config_checked'):
-                self.okx_client.get_account_config()
-                self._config_checked = True
+            self.okx_client.ensure_config_loaded()
             
             # Place market sell order on OKX
             order_result = self.okx_client.place_order(
@@ -507,6 +773,7 @@ class TradingEngine:
                 order_type='market',
                 leverage=leverage
             )
+            self._invalidate_positions_cache()
             
             if order_result['success']:
                 # Record trade in database
@@ -548,6 +815,7 @@ class TradingEngine:
             self.model_id, coin, 'sell_to_enter', quantity, 
             price, leverage, 'short', pnl=0
         )
+        self._apply_trade_to_portfolio(portfolio, coin, 'short', quantity, price, leverage)
         
         return {
             'coin': coin,
@@ -558,7 +826,64 @@ class TradingEngine:
             'message': f'Simulated Short {quantity:.4f} {coin} @ ${price:.2f}'
         }
     
-    def sync_positions_with_exchange(self, force: bool = False):
+    def _apply_trade_to_portfolio(self, portfolio: Dict, coin: str, side: str,
+                                  quantity: float, price: float, leverage: int):
+        """Mirror db.update_position onto a portfolio snapshot"""
+        with self._portfolio_lock:
+            position = {
+                'model_id': self.model_id,
+                'coin': coin,
+                'quantity': quantity,
+                'avg_price': price,
+                'leverage': leverage,
+                'side': side,
+                'current_price': price,
+                'pnl': 0
+            }
+            positions = portfolio['positions']
+            for i, pos in enumerate(positions):
+                if pos['coin'] == coin and pos['side'] == side:
+                    positions[i] = dict(pos, **position)
+                    break
+            else:
+                positions.append(position)
+            self._update_portfolio_totals(portfolio)
+            self._index_positions(portfolio)
+    
+    def _remove_position_from_portfolio(self, portfolio: Dict, coin: str, side: str, pnl: float):
+        """Mirror db.close_position plus its realized P&L onto a portfolio snapshot"""
+        with self._portfolio_lock:
+            portfolio['positions'] = [
+                pos for pos in portfolio['positions']
+                if not (pos['coin'] == coin and pos['side'] == side)
+            ]
+            portfolio['realized_pnl'] += pnl
+            self._update_portfolio_totals(portfolio)
+            self._index_positions(portfolio)
+    
+    def _index_positions(self, portfolio: Dict):
+        """Rebuild the coin -> position index for the cycle's portfolio"""
+        positions_by_coin = {}
+        for pos in portfolio['positions']:
+            positions_by_coin.setdefault(pos['coin'], pos)
+        self._positions_by_coin = positions_by_coin
+    
+    @staticmethod
+    def _update_portfolio_totals(portfolio: Dict):
+        """Recompute derived totals the same way db.get_portfolio does"""
+        positions = portfolio['positions']
+        margin_used = sum([p['quantity'] * p['avg_price'] / p['leverage'] for p in positions])
+        unrealized_pnl = sum([p.get('pnl', 0) for p in positions])
+        initial_capital = portfolio['initial_capital']
+        realized_pnl = portfolio['realized_pnl']
+        
+        portfolio['margin_used'] = margin_used
+        portfolio['positions_value'] = margin_used
+        portfolio['unrealized_pnl'] = unrealized_pnl
+        portfolio['cash'] = initial_capital + realized_pnl - margin_used
+        portfolio['total_value'] = initial_capital + realized_pnl + unrealized_pnl
+    
+    def sync_positions_with_exchange(self, force: bool = False, portfolio: Optional[Dict] = None):
         """
         完整的双向持仓同步机制
 
@@ -569,6 +894,7 @@ class TradingEngine:
 
         Args:
             force: 强制同步，否则使用缓存（60秒内只同步一次）
+            portfolio: 本周期已读取的数据库持仓快照（省略则重新读取）
         """
         if not self.okx_client:
             return
@@ -576,48 +902,54 @@ class TradingEngine:
         # 同步频率控制（避免过于频繁）
         if not force:
             current_time = time.time()
-            last_sync = getattr(self, '_last_sync_time', 0)
-            if current_time - last_sync < 60:  # 60秒内不重复同步
+            if current_time - self._last_sync_time < 60:  # 60秒内不重复同步
                 return
             self._last_sync_time = current_time
 
         try:
-            print(f"\n{'='*60}")
-            print(f"🔄 开始持仓同步检查 - 模型ID: {self.model_id}")
-            print(f"{'='*60}")
-
             # 获取OKX实际持仓
-            okx_positions = self.okx_client.get_positions()
+            okx_positions = self._get_positions_cached()
             okx_active_positions = {}
 
             for pos in okx_positions:
-                size = abs(float(pos.get('size', 0)))
-                if size > 0:  # 只记录有持仓的
-                    symbol = pos['symbol']
-                    coin = symbol.replace('-USDT-SWAP', '')
+                # 先按交易对过滤，其他策略的持仓不做解析
+                coin = self.coin_from_symbol.get(pos.symbol)
+                if coin is None:
+                    continue
+                if abs(pos.size) > 0:  # 只记录有持仓的
                     okx_active_positions[coin] = pos
-                    print(f"📍 OKX持仓: {coin} - {pos['side']} - 数量: {size}")
 
             # 获取数据库持仓
-            portfolio = self.db.get_portfolio(self.model_id)
+            if portfolio is None:
+                portfolio = self.db.get_portfolio(self.model_id)
             db_positions = {pos['coin']: pos for pos in portfolio.get('positions', [])}
 
-            if db_positions:
-                print(f"\n📊 数据库持仓:")
-                for coin, pos in db_positions.items():
-                    print(f"  {coin} - {pos['side']} - 数量: {pos['quantity']}")
-            else:
-                print(f"\n📊 数据库无持仓")
+            # 双方均无持仓，无需比对
+            if not okx_active_positions and not db_positions:
+                return
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("🔄 开始持仓同步检查 - 模型ID: %s", self.model_id)
+                for coin, pos in okx_active_positions.items():
+                    logger.debug("📍 OKX持仓: %s - %s - 数量: %s", coin, pos.side, abs(pos.size))
+                if db_positions:
+                    for coin, pos in db_positions.items():
+                        logger.debug("📊 数据库持仓: %s - %s - 数量: %s", coin, pos['side'], pos['quantity'])
+                else:
+                    logger.debug("📊 数据库无持仓")
+
+            # 持仓完全一致时跳过逐项比对
+            if self._positions_in_sync(okx_active_positions, db_positions):
+                logger.debug("✅ 同步完成，数据库与OKX持仓完全一致 - 模型ID: %s", self.model_id)
+                return
 
             sync_actions = []
 
             # 1. 检查幻影持仓（数据库有但OKX没有）
             for coin, db_pos in db_positions.items():
                 if coin not in okx_active_positions:
-                    print(f"\n🧹 发现幻影持仓: {coin} ({db_pos['side']})")
-                    print(f"   → 数据库显示数量: {db_pos['quantity']}")
-                    print(f"   → OKX实际持仓: 无")
-                    print(f"   → 操作: 清理数据库记录")
+                    logger.debug("🧹 发现幻影持仓: %s (%s) 数据库数量: %s, OKX无持仓 → 清理数据库记录",
+                                 coin, db_pos['side'], db_pos['quantity'])
 
                     self.db.close_position(self.model_id, coin, db_pos['side'])
                     sync_actions.append(f"清理幻影持仓: {coin}")
@@ -625,28 +957,24 @@ class TradingEngine:
             # 2. 检查反向幻影（OKX有但数据库没有）
             for coin, okx_pos in okx_active_positions.items():
                 if coin not in db_positions:
-                    print(f"\n🔍 发现反向幻影: {coin} ({okx_pos['side']})")
-                    print(f"   → OKX实际持仓: {okx_pos['size']}")
-                    print(f"   → 数据库记录: 无")
-                    print(f"   → 操作: 添加到数据库")
+                    logger.debug("🔍 发现反向幻影: %s (%s) OKX数量: %s, 数据库无记录 → 添加到数据库",
+                                 coin, okx_pos.side, okx_pos.size)
 
                     # 添加到数据库
                     self.db.update_position(
                         self.model_id,
                         coin,
-                        float(okx_pos['size']),
-                        float(okx_pos['avg_price']),
-                        int(float(okx_pos.get('leverage', 1))),
-                        okx_pos['side']
+                        okx_pos.size,
+                        okx_pos.avg_price,
+                        okx_pos.leverage,
+                        okx_pos.side
                     )
                     sync_actions.append(f"添加反向幻影: {coin}")
 
-                elif db_positions[coin]['side'] != okx_pos['side']:
+                elif db_positions[coin]['side'] != okx_pos.side:
                     # 持仓方向不一致（这种情况比较严重）
-                    print(f"\n⚠️  持仓方向不一致: {coin}")
-                    print(f"   → 数据库方向: {db_positions[coin]['side']}")
-                    print(f"   → OKX方向: {okx_pos['side']}")
-                    print(f"   → 操作: 以OKX为准，更新数据库")
+                    logger.debug("⚠️ 持仓方向不一致: %s 数据库: %s, OKX: %s → 以OKX为准，更新数据库",
+                                 coin, db_positions[coin]['side'], okx_pos.side)
 
                     # 先清理旧的
                     self.db.close_position(self.model_id, coin, db_positions[coin]['side'])
@@ -654,213 +982,248 @@ class TradingEngine:
                     self.db.update_position(
                         self.model_id,
                         coin,
-                        float(okx_pos['size']),
-                        float(okx_pos['avg_price']),
-                        int(float(okx_pos.get('leverage', 1))),
-                        okx_pos['side']
+                        okx_pos.size,
+                        okx_pos.avg_price,
+                        okx_pos.leverage,
+                        okx_pos.side
                     )
                     sync_actions.append(f"修正方向不一致: {coin}")
 
             # 3. 检查数量不一致
-            for coin in set(db_positions.keys()) & set(okx_active_positions.keys()):
+            for coin in db_positions.keys() & okx_active_positions.keys():
                 db_pos = db_positions[coin]
                 okx_pos = okx_active_positions[coin]
 
                 db_qty = float(db_pos['quantity'])
-                okx_qty = float(okx_pos['size'])
+                okx_qty = okx_pos.size
 
                 # 允许0.01%的误差
-                if abs(db_qty - okx_qty) / max(db_qty, okx_qty) > 0.0001:
-                    print(f"\n📐 数量不一致: {coin}")
-                    print(f"   → 数据库数量: {db_qty}")
-                    print(f"   → OKX数量: {okx_qty}")
-                    print(f"   → 差异: {abs(db_qty - okx_qty)}")
-                    print(f"   → 操作: 更新为OKX实际数量")
+                if not math.isclose(db_qty, okx_qty, rel_tol=1e-4, abs_tol=1e-8):
+                    logger.debug("📐 数量不一致: %s 数据库: %s, OKX: %s → 更新为OKX实际数量",
+                                 coin, db_qty, okx_qty)
 
                     # 更新为OKX的实际数量
                     self.db.update_position(
                         self.model_id,
                         coin,
                         okx_qty,
-                        float(okx_pos['avg_price']),
-                        int(float(okx_pos.get('leverage', 1))),
-                        okx_pos['side']
+                        okx_pos.avg_price,
+                        okx_pos.leverage,
+                        okx_pos.side
                     )
                     sync_actions.append(f"更新数量: {coin} ({db_qty:.4f} → {okx_qty:.4f})")
 
-            # 同步总结
-            print(f"\n{'='*60}")
+            # 同步总结（有修复操作时保留一条审计记录）
             if sync_actions:
-                print(f"✅ 同步完成，执行了 {len(sync_actions)} 个操作:")
-                for action in sync_actions:
-                    print(f"   • {action}")
+                self._portfolio_stale = True
+                logger.info("✅ 同步完成 - 模型ID: %s，执行了 %d 个操作: %s",
+                            self.model_id, len(sync_actions), '; '.join(sync_actions))
             else:
-                print(f"✅ 同步完成，数据库与OKX持仓完全一致")
-            print(f"{'='*60}\n")
+                logger.debug("✅ 同步完成，数据库与OKX持仓完全一致 - 模型ID: %s", self.model_id)
 
         except Exception as e:
-            print(f"❌ 持仓同步错误: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ 持仓同步错误: %s", e)
+
+    @staticmethod
+    def _positions_in_sync(okx_active_positions: Dict, db_positions: Dict) -> bool:
+        """True when both sides hold the same coins with the same side and quantity (0.01% tolerance)"""
+        if okx_active_positions.keys() != db_positions.keys():
+            return False
+        for coin, okx_pos in okx_active_positions.items():
+            db_pos = db_positions[coin]
+            if db_pos['side'] != okx_pos.side:
+                return False
+            db_qty = float(db_pos['quantity'])
+            okx_qty = okx_pos.size
+            if not math.isclose(db_qty, okx_qty, rel_tol=1e-4, abs_tol=1e-8):
+                return False
+        return True
+
+    @staticmethod
+    def _close_pnl(side: str, entry_price: float, current_price: float, quantity: float) -> float:
+        """Realized P&L of closing a long/short position at current_price"""
+        # Kept as two expressions: a +/-1 multiplier would turn a flat short into -0.0
+        if side == 'long':
+            return (current_price - entry_price) * quantity
+        return (entry_price - current_price) * quantity
+
+    @staticmethod
+    def _close_pnls(sides: List[str], entry_prices: List[float], current_prices: List[float],
+                    quantities: List[float]) -> List[float]:
+        """_close_pnl over many positions, as one array operation when NumPy is installed"""
+        if NUMPY_AVAILABLE and len(sides) > 1:
+            is_long = np.fromiter((side == 'long' for side in sides), dtype=bool, count=len(sides))
+            entry = np.asarray(entry_prices, dtype=np.float64)
+            current = np.asarray(current_prices, dtype=np.float64)
+            qty = np.asarray(quantities, dtype=np.float64)
+            return np.where(is_long, (current - entry) * qty, (entry - current) * qty).tolist()
+        return [TradingEngine._close_pnl(*args)
+                for args in zip(sides, entry_prices, current_prices, quantities)]
+
+    @staticmethod
+    def _market_price(market_state: Dict, coin: str) -> Optional[float]:
+        """Current price of a coin, or None when market data for it is missing"""
+        entry = market_state.get(coin)
+        return entry.get('price') if entry else None
 
     def _execute_close(self, coin: str, decision: Dict, market_state: Dict, 
                       portfolio: Dict) -> Dict:
-        # Sync positions before closing to avoid phantom position issues
         if self.okx_client:
-            self.sync_positions_with_exchange()
-            return self._execute_okx_close(coin, market_state)
+            return self._execute_okx_closes([coin], market_state, portfolio)[0]
         else:
             return self._execute_simulated_close(coin, market_state, portfolio)
     
-    def _execute_okx_close(self, coin: str, market_state: Dict) -> Dict:
-        """Execute close position via OKX API"""
+    def _execute_okx_closes(self, coins: List[str], market_state: Dict, portfolio: Dict) -> List[Dict]:
+        """Close coins on OKX, one result per coin"""
+        # Sync positions before closing to avoid phantom position issues
+        # (unless this cycle has already synced)
+        if not self._synced_this_cycle:
+            self.sync_positions_with_exchange(portfolio=None if self._portfolio_stale else portfolio)
+        results = self._execute_okx_close_batch(coins, market_state)
+        if any('error' not in result for result in results):
+            self._portfolio_stale = True
+        return results
+    
+    def _execute_okx_close_batch(self, coins: List[str], market_state: Dict) -> List[Dict]:
+        """Send each close to OKX, then price and record all the fills together"""
         try:
-            symbol = self.okx_symbols.get(coin)
-            if not symbol:
-                return {'coin': coin, 'error': f'Unsupported coin: {coin}'}
-            
-            # Get current position before closing
-            positions = self.okx_client.get_positions()
-            target_position = None
-            for pos in positions:
-                if pos['symbol'] == symbol:
-                    target_position = pos
-                    break
-            
-            if not target_position:
-                # Check if we have a phantom position in database that needs cleanup
-                portfolio = self.db.get_portfolio(self.model_id)
-                db_position = None
-                for pos in portfolio.get('positions', []):
-                    if pos['coin'] == coin:
-                        db_position = pos
-                        break
-                
-                if db_position:
-                    # Clean up phantom position in database
-                    self.db.close_position(self.model_id, coin, db_position['side'])
-                    return {
-                        'coin': coin,
-                        'signal': 'close_position',
-                        'quantity': 0,
-                        'price': market_state[coin]['price'],
-                        'pnl': 0,
-                        'message': f'Cleaned up phantom position for {coin} (already closed on exchange)'
-                    }
-                
-                return {'coin': coin, 'error': 'No position to close'}
-            
-            # Check if position is already closed (0 quantity)
-            position_size = abs(float(target_position.get('size', 0)))
-            if position_size == 0:
-                # Position is already closed on OKX, clean up database
-                portfolio = self.db.get_portfolio(self.model_id)
-                for pos in portfolio.get('positions', []):
-                    if pos['coin'] == coin:
-                        self.db.close_position(self.model_id, coin, pos['side'])
-                        break
-                
-                return {
-                    'coin': coin,
-                    'signal': 'close_position',
-                    'quantity': 0,
-                    'price': market_state[coin]['price'],
-                    'pnl': 0,
-                    'message': f'Position for {coin} already closed on exchange, database synced'
-                }
-            
-            # Close position on OKX
-            close_result = self.okx_client.close_position(symbol=symbol)
-
-            if close_result['success']:
-                current_price = market_state[coin]['price']
-                position_side = target_position.get('side', 'long')
-
-                # Check if position was already closed
-                if close_result.get('already_closed'):
-                    # Position already closed - just clean up database
-                    self.db.close_position(self.model_id, coin, position_side)
-                    print(f"[INFO] Cleaned up phantom position for {coin} - already closed on OKX")
-
-                    return {
-                        'coin': coin,
-                        'signal': 'close_position',
-                        'quantity': 0,
-                        'price': current_price,
-                        'pnl': 0,
-                        'message': f'Position for {coin} already closed on OKX, database cleaned up'
-                    }
-
-                # Position was actually closed now - calculate P&L
-                closed_quantity = position_size
-                entry_price = float(target_position.get('avg_price', current_price))
-
-                # Calculate P&L
-                if position_side == 'long':
-                    pnl = (current_price - entry_price) * closed_quantity
-                else:
-                    pnl = (entry_price - current_price) * closed_quantity
+            # One positions snapshot serves the whole batch
+            by_symbol = self._positions_by_symbol()
+        except Exception as e:
+            return [{'coin': coin, 'error': f'OKX API error: {str(e)}'} for coin in coins]
+        
+        def start(coin):
+            try:
+                return self._start_okx_close(coin, market_state, by_symbol)
+            except Exception as e:
+                return {'coin': coin, 'error': f'OKX API error: {str(e)}'}
+        
+        if len(coins) > 1:
+            # Closes on different symbols are independent: overlap their round-trips
+            with ThreadPoolExecutor(max_workers=min(len(coins), MAX_OKX_CLOSE_WORKERS)) as pool:
+                outcomes = list(pool.map(start, coins))
+        else:
+            outcomes = [start(coin) for coin in coins]
+        
+        results = [None] * len(coins)
+        fills = []
+        for i, outcome in enumerate(outcomes):
+            if isinstance(outcome, tuple):
+                fills.append((i,) + outcome)
+            else:
+                results[i] = outcome
+        
+        if fills:
+            try:
+                self._record_okx_fills(fills, results)
+            except Exception as e:
+                for fill in fills:
+                    results[fill[0]] = {'coin': fill[1], 'error': f'OKX API error: {str(e)}'}
+        return results
+    
+    def _start_okx_close(self, coin: str, market_state: Dict, by_symbol: Dict):
+        """Close one coin on OKX; returns its result, or a fill tuple still to be recorded"""
+        try:
+            symbol = self._sym[coin]
+        except KeyError:
+            return {'coin': coin, 'error': f'Unsupported coin: {coin}'}
+        
+        # Check the price first so a close is never sent that couldn't be recorded
+        current_price = self._market_price(market_state, coin)
+        if current_price is None:
+            return {'coin': coin, 'error': f'No market price for {coin}'}
+        
+        # Fast path: an open position on the exchange is closed right away
+        target_position = by_symbol.get(symbol)
+        if target_position is not None and target_position.size != 0:
+            return self._close_open_position(coin, symbol, target_position, current_price)
+        
+        return self._cleanup_missing_position(coin, current_price, listed=target_position is not None)
+    
+    def _record_okx_fills(self, fills: List[tuple], results: List[Optional[Dict]]):
+        """Compute P&L for every OKX fill at once and record them in one transaction"""
+        slots, coins, sides, quantities, entry_prices, prices, order_ids = zip(*fills)
+        pnls = self._close_pnls(sides, entry_prices, prices, quantities)
+        
+        # Close positions and record the trades in one transaction
+        self.db.close_and_record_trades(self.model_id, [
+            (coin, side, quantity, price, 1, pnl)
+            for coin, side, quantity, price, pnl in zip(coins, sides, quantities, prices, pnls)
+        ])
+        
+        for slot, coin, quantity, price, pnl, order_id in zip(slots, coins, quantities, prices, pnls, order_ids):
+            results[slot] = _close_result(
+                coin, quantity, price, pnl,
+                f'OKX Close {coin} position: {quantity} @ ${price:.2f}, P&L: ${pnl:.2f}',
+                order_id=order_id
+            )
+    
+    def _close_open_position(self, coin: str, symbol: str, target_position: PositionSnapshot,
+                             current_price: float):
+        """Close an open OKX position; a real fill comes back as (coin, side, quantity, entry, price, order_id)"""
+        close_result = self.okx_client.close_position(symbol=symbol)
+        self._invalidate_positions_cache()
 
-                # Close position in database
-                self.db.close_position(self.model_id, coin, position_side)
+        if close_result['success']:
+            position_side = target_position.side
 
-                # Record trade in database with actual values
-                self.db.add_trade(
-                    self.model_id, coin, 'close_position', closed_quantity,
-                    current_price, 1, position_side, pnl=pnl
-                )
+            # Check if position was already closed
+            if close_result.get('already_closed'):
+                logger.info("Cleaned up phantom position for %s - already closed on OKX", coin)
+                return self._handle_already_closed(coin, position_side, current_price, 'already_closed_okx')
 
-                return {
-                    'coin': coin,
-                    'signal': 'close_position',
-                    'quantity': closed_quantity,
-                    'price': current_price,
-                    'pnl': pnl,
-                    'order_id': close_result.get('order_id'),
-                    'message': f'OKX Close {coin} position: {closed_quantity} @ ${current_price:.2f}, P&L: ${pnl:.2f}'
-                }
-            else:
-                return {
-                    'coin': coin,
-                    'error': f'OKX close failed: {close_result.get("message", "Unknown error")}'
-                }
-                
-        except Exception as e:
-            return {'coin': coin, 'error': f'OKX API error: {str(e)}'}
+            # Position was actually closed now - P&L is computed when the fill is recorded
+            entry_price = target_position.avg_price
+            if entry_price is None:
+                entry_price = current_price
+            return (coin, position_side, abs(target_position.size), entry_price,
+                    current_price, close_result.get('order_id'))
+        else:
+            return {
+                'coin': coin,
+                'error': f'OKX close failed: {close_result.get("message", "Unknown error")}'
+            }
+    
+    def _cleanup_missing_position(self, coin: str, current_price: float, listed: bool) -> Dict:
+        """Slow path of a close: nothing is open on OKX, so only the database may need cleanup
+        
+        `listed` is True when OKX still reports the position with zero size.
+        """
+        # One DELETE whatever the side; whether it matched tells a phantom from nothing to close
+        removed = self.db.close_positions_for_coin(self.model_id, coin)
+        
+        if listed:
+            return self._handle_already_closed(coin, None, current_price, 'zero_size_exchange')
+        if removed:
+            return self._handle_already_closed(coin, None, current_price, 'phantom_db')
+        return {'coin': coin, 'error': 'No position to close'}
+    
+    def _handle_already_closed(self, coin: str, side: Optional[str], price: float, reason: str) -> Dict:
+        """Drop the database position for a coin OKX no longer holds (side=None: already dropped)"""
+        if side is not None:
+            self.db.close_position(self.model_id, coin, side)
+        return _close_result(coin, 0, price, 0, _ALREADY_CLOSED_MSGS[reason].format(coin))
     
     def _execute_simulated_close(self, coin: str, market_state: Dict, portfolio: Dict) -> Dict:
         """Execute simulated close position (fallback)"""
-        position = None
-        for pos in portfolio['positions']:
-            if pos['coin'] == coin:
-                position = pos
-                break
+        position = self._positions_by_coin.get(coin)
         
         if not position:
             return {'coin': coin, 'error': 'Position not found'}
         
-        current_price = market_state[coin]['price']
+        current_price = self._market_price(market_state, coin)
+        if current_price is None:
+            return {'coin': coin, 'error': f'No market price for {coin}'}
         entry_price = position['avg_price']
         quantity = position['quantity']
         side = position['side']
+        pnl = self._close_pnl(side, entry_price, current_price, quantity)
         
-        if side == 'long':
-            pnl = (current_price - entry_price) * quantity
-        else:
-            pnl = (entry_price - current_price) * quantity
-        
-        self.db.close_position(self.model_id, coin, side)
-        
-        self.db.add_trade(
-            self.model_id, coin, 'close_position', quantity,
-            current_price, position['leverage'], side, pnl=pnl
+        # Close position and record the trade in one transaction
+        self.db.close_and_record_trade(
+            self.model_id, coin, side, quantity,
+            current_price, position['leverage'], pnl=pnl
         )
+        self._remove_position_from_portfolio(portfolio, coin, side, pnl)
         
-        return {
-            'coin': coin,
-            'signal': 'close_position',
-            'quantity': quantity,
-            'price': current_price,
-            'pnl': pnl,
-            'message': f'Simulated Close {coin}, P&L: ${pnl:.2f}'
-        }
+        return _close_result(coin, quantity, current_price, pnl, f'Simulated Close {coin}, P&L: ${pnl:.2f}')